@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Time StructureAliases.get_best_template_roi_match for a 60 ROI plan against a synthetic alias library, and check
+the indexed result against a brute force get_combined_fuzz_scores over all_rois.
+usage: python benchmarks/bench_alias_matching.py [template_roi_count ...]
+"""
+
+import random
+import sys
+from os.path import dirname, join, abspath
+from time import perf_counter
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'dvh_check'))
+from structure_aliases import StructureAliases, get_combined_fuzz_scores  # noqa: E402
+
+WORDS = ['Lung', 'Heart', 'Cord', 'Spinal', 'PTV', 'CTV', 'GTV', 'Bowel', 'Liver', 'Kidney', 'Eso', 'Brain',
+         'Stem', 'L', 'R', '_', ' ', '50', '60', 'opt', 'Ring', 'Rectum', 'Bladder']
+PLAN_ROI_COUNT = 60
+
+
+def get_random_name():
+    return ''.join(random.choice(WORDS) for _ in range(random.randint(1, 4)))
+
+
+def get_brute_force_match(aliases, roi):
+    all_rois = aliases.all_rois
+    best_score, best_match = get_combined_fuzz_scores(roi, all_rois)[0]
+    for template_roi in aliases.roi:
+        if best_match == template_roi or best_match in aliases.roi[template_roi]:
+            return template_roi, roi, best_score
+
+
+def main():
+    template_counts = [int(n) for n in sys.argv[1:]] or [100, 1000]
+    for template_count in template_counts:
+        random.seed(template_count)
+        aliases = StructureAliases()
+        for i in range(template_count):
+            aliases.add_template_roi('T%d %s' % (i, get_random_name()),
+                                     sorted(set(get_random_name() for _ in range(random.randint(0, 8)))))
+        plan_rois = [get_random_name() for _ in range(PLAN_ROI_COUNT)]
+
+        start = perf_counter()
+        aliases.alias_index
+        index_time = perf_counter() - start
+
+        start = perf_counter()
+        matches = [aliases.get_best_template_roi_match(roi) for roi in plan_rois]
+        elapsed = perf_counter() - start
+
+        start = perf_counter()
+        expected = [get_brute_force_match(aliases, roi) for roi in plan_rois]
+        brute_force = perf_counter() - start
+
+        print('%6d aliases: index %7.3f ms, match %7.3f ms, brute force %8.3f ms, identical: %s' %
+              (len(aliases.all_rois), 1e3 * index_time, 1e3 * elapsed, 1e3 * brute_force, matches == expected))
+
+
+if __name__ == '__main__':
+    main()
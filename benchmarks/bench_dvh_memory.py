@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compare time, peak Python heap (tracemalloc) and peak RSS of dvhcalc.get_dvh against the memory-mapped
+dvh_stream.get_dvh (one ROI per pass) and dvh_stream.get_dvhs (every ROI in one pass) on synthetic RT Dose grids,
+and check that all give the same DVHs.  The structure set is parsed beforehand, so the peaks are what each engine
+needs for the dose grid.  tracemalloc doesn't see numpy's memory maps or memory allocated outside Python's
+allocators, so each engine is also run in a forked process and its RSS high-water mark over the RSS it started with
+is reported (Linux).
+usage: python benchmarks/bench_dvh_memory.py [frames ...]
+"""
+
+import logging
+import resource
+import sys
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from os.path import dirname, join, abspath
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import numpy as np
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'dvh_check'))
+sys.path.insert(0, dirname(abspath(__file__)))
+from dicompylercore import dicomparser, dvhcalc  # noqa: E402
+import dvh_stream  # noqa: E402
+from synthetic_dicom import write_plan_files  # noqa: E402
+
+ROWS, COLUMNS = 256, 256
+
+logging.getLogger('dicompylercore').setLevel(logging.ERROR)  # contours beyond the dose grid are expected
+
+
+def measure(func, *args):
+    # returns (result, seconds, tracemalloc peak, RSS increase), each engine in a new process since ru_maxrss only
+    # ever grows
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('fork')) as executor:
+        return executor.submit(measure_in_process, func, *args).result()
+
+
+def measure_in_process(func, *args):
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # a forked process starts at its parent's RSS
+    tracemalloc.start()
+    start = perf_counter()
+    result = func(*args)
+    elapsed = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    rss = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_rss) * 1024  # ru_maxrss is in KiB
+    return result, elapsed, peak, rss
+
+
+def calculate_dvhcalc(rtss, rtdose_file, roi_keys):
+    return [dvhcalc.get_dvh(rtss.ds, rtdose_file, key) for key in roi_keys]
+
+
+def calculate_stream(rtss, rtdose_file, roi_keys):
+    return [dvh_stream.get_dvh(rtss, rtdose_file, key) for key in roi_keys]
+
+
+def calculate_one_pass(rtss, rtdose_file, roi_keys):
+    dvhs = dvh_stream.get_dvhs(rtss, rtdose_file, roi_keys)
+    return [dvhs[key] for key in roi_keys]
+
+
+def main():
+    frame_counts = [int(n) for n in sys.argv[1:]] or [50, 200]
+    for frames in frame_counts:
+        with TemporaryDirectory() as directory:
+            files = write_plan_files(directory, dose_shape=(frames, ROWS, COLUMNS))
+            rtss = dicomparser.DicomParser(files['rtstruct'])
+            roi_keys = list(rtss.GetStructures())
+            for key in roi_keys:
+                rtss.GetStructureCoordinates(key)  # pydicom converts the contour data on first access
+            plane_mb = ROWS * COLUMNS * 8 / 1024. ** 2  # one plane as float64, as dvhcalc scales it
+            print('%d x %d x %d dose grid, %.1f MB of pixel data, %.1f MB per float64 plane, %d ROIs' %
+                  (frames, ROWS, COLUMNS, frames * plane_mb / 2, plane_mb, len(roi_keys)))
+
+            expected, elapsed, peak, rss = measure(calculate_dvhcalc, rtss, files['rtdose'], roi_keys)
+            print('  %-19s %7.2f s, peak %7.1f MB, RSS +%7.1f MB' %
+                  ('dvhcalc.get_dvh:', elapsed, peak / 1024. ** 2, rss / 1024. ** 2))
+            identical = True
+            for label, func in [('dvh_stream.get_dvh', calculate_stream), ('dvh_stream.get_dvhs', calculate_one_pass)]:
+                dvhs, elapsed, peak, rss = measure(func, rtss, files['rtdose'], roi_keys)
+                print('  %-19s %7.2f s, peak %7.1f MB, RSS +%7.1f MB' %
+                      (label + ':', elapsed, peak / 1024. ** 2, rss / 1024. ** 2))
+                identical &= all(np.array_equal(a.counts, b.counts) and np.array_equal(a.bins, b.bins)
+                                 for a, b in zip(expected, dvhs))
+            print('  identical DVHs: %s' % identical)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Time scorecard.evaluate_constraints against calculate_constraint and get_pass_fail row by row, for every bundled
+protocol and fractionation, on 40 synthetic cumulative DVHs of 2000 to 7000 1 cGy bins (with dose free plateaus and
+an empty DVH), and check that values and pass/fail are identical.  Rows point to random ROIs, some unmatched, with
+random constraint inputs.  Exits with status 1 on any difference.
+usage: python benchmarks/bench_evaluate.py [repeat]
+"""
+
+import random
+import sys
+from os.path import dirname, join, abspath
+from time import perf_counter
+import numpy as np
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'dvh_check'))
+from dicompylercore.dvh import DVH  # noqa: E402
+from protocols import Protocols  # noqa: E402
+from scorecard import calculate_constraint, get_pass_fail, get_dvh_stack, evaluate_constraints  # noqa: E402
+
+ROI_COUNT = 40
+SEED = 0
+
+
+def get_synthetic_dvh(bin_count):
+    if bin_count <= 1:
+        return DVH(np.zeros(1), np.arange(0, 2), dvh_type='cumulative', dose_units='Gy', name='empty')
+    counts = np.random.exponential(1., bin_count) * (np.random.rand(bin_count) < 0.6)
+    counts[:np.random.randint(0, bin_count // 3)] = 0.
+    return DVH(counts, np.arange(bin_count + 1) / 100, dvh_type='differential', dose_units='Gy', name='roi').cumulative
+
+
+def get_rows(column_data, dvhs):
+    # (roi_index, column_data with random inputs)
+    roi_index = [random.randint(-1, len(dvhs) - 1) for _ in column_data['roi_template']]
+    input_value = []
+    for calc_type, i in zip(column_data['calc_type'], roi_index):
+        volume = dvhs[i].counts.max() if i >= 0 else 1.
+        input_value.append(None if calc_type == 'Mean' else
+                           round(random.choice([random.uniform(0., 70.), random.uniform(0., volume), volume]), 3))
+    return roi_index, dict(column_data, input_value=input_value)
+
+
+def evaluate_rows(column_data, dvhs, roi_index):
+    values, pass_fail = [], []
+    for i, roi in enumerate(roi_index):
+        value = None if roi < 0 else calculate_constraint(dvhs[roi], column_data['calc_type'][i],
+                                                          column_data['input_value'][i])
+        values.append(np.nan if value is None else value)
+        pass_fail.append(get_pass_fail(value, column_data['operator'][i], column_data['threshold_value'][i]))
+    return values, pass_fail
+
+
+def time_call(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        result = func()
+        times.append(perf_counter() - start)
+    return result, min(times)
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    random.seed(SEED)
+    np.random.seed(SEED)
+    dvhs = [get_synthetic_dvh(random.randint(2000, 7000)) for _ in range(ROI_COUNT - 1)] + [get_synthetic_dvh(1)]
+    dvh_stack, lengths, bin_width = get_dvh_stack(dvhs)
+
+    protocols = Protocols()
+    failures = 0
+    for name in protocols.protocol_names:
+        for fractionation in protocols.get_fractionations(name):
+            roi_index, column_data = get_rows(protocols.get_column_data(name, '%sFx' % fractionation), dvhs)
+            expected, row_time = time_call(lambda: evaluate_rows(column_data, dvhs, roi_index), repeat)
+            result, vectorized_time = time_call(
+                lambda: evaluate_constraints(column_data, dvh_stack, lengths, roi_index, bin_width), repeat)
+            mismatches = [i for i in range(len(roi_index))
+                          if not np.array_equal(expected[0][i], result[0][i], equal_nan=True) or
+                          expected[1][i] != result[1][i]]
+            print('%-16s %3s Fx %3d rows: per row %7.2f ms, vectorized %7.2f ms, %d mismatches' %
+                  (name, fractionation, len(roi_index), 1e3 * row_time, 1e3 * vectorized_time, len(mismatches)))
+            for i in mismatches[:5]:
+                print('    %s %s: %r, %r != %r, %r' % (column_data['calc_type'][i], column_data['input_value'][i],
+                                                   expected[0][i], expected[1][i], result[0][i], result[1][i]))
+            failures += len(mismatches)
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Check that batched ROI matching (rapidfuzz ratio matrix, and the character count fallback without rapidfuzz)
+gives the same best match and score as get_combined_fuzz_scores for every name in aliases.csv, plus perturbed
+copies of them, and time each mode.  The same is checked for a seeded random alias table and plan ROIs, including
+pairs built so that 100 * Levenshtein.ratio lands exactly on a half point (e.g., 12.5 or 87.5) where rounding can
+differ.  AliasIndex.get_ratio_matrix is also compared with fuzzywuzzy's fuzz.ratio, and get_bounds checked to never be
+below the score from fuzz.ratio and fuzz.partial_ratio, for every pair.  Exits with status 1 on any difference.
+usage: python benchmarks/bench_fuzz_matrix.py
+"""
+
+import random
+import sys
+from os.path import dirname, join, abspath
+from time import perf_counter
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'dvh_check'))
+import structure_aliases  # noqa: E402
+from structure_aliases import StructureAliases, AliasIndex, get_combined_fuzz_scores, clean_name  # noqa: E402
+
+SEED = 0
+RANDOM_TEMPLATES = 60
+
+
+def get_perturbed_name(name):
+    # mimic the variations seen in plan ROI names
+    name = random.choice([name, name.upper(), name.lower(), name.replace(' ', '_')])
+    if random.random() < 0.5:
+        name = random.choice(['', 'z', 'opt', '_PRV']) + name + random.choice(['', '_L', ' R', '1', '_5mm'])
+    if len(name) > 3 and random.random() < 0.3:
+        i = random.randint(0, len(name) - 1)
+        name = name[:i] + name[i + 1:]
+    return name
+
+
+def check_pairs(index, keys):
+    # returns the number of pairs where the ratio matrix or the bounds disagree with fuzzywuzzy
+    failures = 0
+    simple = None if structure_aliases.process is None else index.get_ratio_matrix(keys)
+    for i, key in enumerate(keys):
+        bounds = index.get_bounds(key, None if simple is None else simple[i])
+        for j, alias_key in enumerate(index.keys):
+            expected_simple = structure_aliases.fuzz.ratio(key, alias_key) * index.w_simple
+            if simple is not None and simple[i, j] != expected_simple:
+                failures += 1
+                if failures <= 10:
+                    print('    ratio %r, %r: %s != %s' % (key, alias_key, simple[i, j], expected_simple))
+            score = index.get_score(key, alias_key)
+            if bounds[j] < score:
+                failures += 1
+                if failures <= 10:
+                    print('    bound %r, %r: %s < %s' % (key, alias_key, bounds[j], score))
+    return failures
+
+
+def get_random_name():
+    # random case, spaces and underscores so clean_name has something to do
+    return ''.join(random.choice('abcdeAB _') for _ in range(random.randint(1, 24)))
+
+
+def get_half_point_pairs():
+    # (plan roi, alias) where fuzz.ratio's 100 * (1 - distance / length) is exactly n + 0.5, the keys are "['name']"
+    # so length is len(a) + len(b) + 8 and the distance is from the unshared 'x' and 'y' filler
+    pairs = []
+    for length in range(16, 129, 16):
+        for d in range(1, length - 7):
+            if (200 * d) % length or (200 * d // length) % 2 == 0 or (length - 8 - d) % 2:
+                continue
+            common = (length - 8 - d) // 2
+            base = ''.join(random.choice('abcde') for _ in range(common))
+            n = random.randint(common, length - 8 - common)
+            pairs.append((base + 'x' * (n - common), base + 'y' * (length - 8 - n - common)))
+    return pairs
+
+
+def check_pairs(index, keys):
+    # returns the number of pairs where the ratio matrix or the bounds disagree with fuzzywuzzy
+    failures = 0
+    simple = None if structure_aliases.process is None else index.get_ratio_matrix(keys)
+    for i, key in enumerate(keys):
+        bounds = index.get_bounds(key, None if simple is None else simple[i])
+        for j, alias_key in enumerate(index.keys):
+            expected_simple = structure_aliases.fuzz.ratio(key, alias_key) * index.w_simple
+            if simple is not None and simple[i, j] != expected_simple:
+                failures += 1
+                if failures <= 10:
+                    print('    ratio %r, %r: %s != %s' % (key, alias_key, simple[i, j], expected_simple))
+            score = index.get_score(key, alias_key)
+            if bounds[j] < score:
+                failures += 1
+                if failures <= 10:
+                    print('    bound %r, %r: %s < %s' % (key, alias_key, bounds[j], score))
+    return failures
+
+
+def check_table(roi, plan_rois):
+    # returns the number of best matches and pairs that differ from fuzzywuzzy for an alias table {template: [aliases]}
+    all_rois = [name for template_roi in roi for name in [template_roi] + roi[template_roi]]
+    failures = 0
+
+    start = perf_counter()
+    expected = [tuple(get_combined_fuzz_scores(name, all_rois)[0][::-1]) for name in plan_rois]
+    print('%5d plan rois vs %d aliases' % (len(plan_rois), len(all_rois)))
+    print('  get_combined_fuzz_scores: %8.3f ms' % (1e3 * (perf_counter() - start)))
+
+    process = structure_aliases.process
+    modes = [('ratio matrix', process), ('character bounds', None)]
+    for label, mode_process in modes:
+        if label == 'ratio matrix' and mode_process is None:
+            print('  %s: rapidfuzz is not installed' % label)
+            continue
+        structure_aliases.process = mode_process
+        start = perf_counter()
+        index = AliasIndex(roi)
+        matches = index.get_best_matches(plan_rois)
+        elapsed = perf_counter() - start
+        mismatches = [(name, match, expected[i]) for i, (name, match) in enumerate(zip(plan_rois, matches))
+                      if match != expected[i]]
+        print('  %s: %8.3f ms, %d mismatches' % (label, 1e3 * elapsed, len(mismatches)))
+        for mismatch in mismatches[:10]:
+            print('    %r: %r != %r' % mismatch)
+        pair_failures = check_pairs(index, list(dict.fromkeys(str(clean_name(name)) for name in plan_rois)))
+        print('  %s: %d pairs differ from fuzzywuzzy' % (label, pair_failures))
+        failures += len(mismatches) + pair_failures
+    structure_aliases.process = process
+
+    return failures
+
+
+def main():
+    random.seed(SEED)
+    aliases = StructureAliases()
+    plan_rois = aliases.all_rois + [get_perturbed_name(name) for name in aliases.all_rois for _ in range(3)]
+    print('aliases.csv')
+    failures = check_table(aliases.roi, plan_rois)
+
+    half_point_pairs = get_half_point_pairs()
+    names = [get_random_name() for _ in range(4 * RANDOM_TEMPLATES)] + [alias for _, alias in half_point_pairs]
+    random.shuffle(names)
+    roi = {'template %d' % i: names[i::RANDOM_TEMPLATES] for i in range(RANDOM_TEMPLATES)}
+    plan_rois = [get_random_name() for _ in range(200)] + [name for name, _ in half_point_pairs]
+    plan_rois += [get_perturbed_name(random.choice(names)) for _ in range(100)]
+    print('random, %d half point pairs' % len(half_point_pairs))
+    failures += check_table(roi, plan_rois)
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
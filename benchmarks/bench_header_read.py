@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compare bytes read and wall time of a full header read (stop_before_pixels) against the tag-limited read used by
+the inbox scan (utilities.HEADER_TAGS).
+usage: python benchmarks/bench_header_read.py [dicom_file_or_directory ...]
+"""
+
+import io
+import sys
+from os.path import dirname, join, abspath, basename, getsize
+from time import perf_counter
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'dvh_check'))
+import pydicom as dicom  # noqa: E402
+from utilities import get_file_paths, HEADER_TAGS  # noqa: E402
+
+TEST_FILES_DIR = join(dirname(dirname(abspath(__file__))), 'dvh-check', 'test_files')
+REPEAT = 5
+
+
+class ByteCountingFile(io.FileIO):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def readinto(self, buffer):
+        count = super().readinto(buffer)
+        self.bytes_read += count or 0
+        return count
+
+
+def benchmark(file_path, **kwargs):
+    start = perf_counter()
+    for _ in range(REPEAT):
+        with ByteCountingFile(file_path, 'rb') as fp:
+            dicom.read_file(fp, stop_before_pixels=True, **kwargs)
+            bytes_read = fp.bytes_read
+    return bytes_read, (perf_counter() - start) / REPEAT
+
+
+def main():
+    file_paths = []
+    for path in sys.argv[1:] or [TEST_FILES_DIR]:
+        file_paths.extend(get_file_paths(path) or [path])
+
+    totals = [0, 0., 0, 0.]
+    print('%-14s %10s %12s %10s %12s %10s' % ('file', 'size', 'full bytes', 'full ms', 'header bytes', 'header ms'))
+    for file_path in sorted(file_paths):
+        full = benchmark(file_path)
+        header = benchmark(file_path, specific_tags=HEADER_TAGS)
+        for i, value in enumerate(full + header):
+            totals[i] += value
+        print('%-14s %10d %12d %10.2f %12d %10.2f' % (basename(file_path)[-14:], getsize(file_path), full[0],
+                                                     full[1] * 1000, header[0], header[1] * 1000))
+    print('%-14s %10s %12d %10.2f %12d %10.2f' % ('total', '', totals[0], totals[1] * 1000, totals[2], totals[3] * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Time utilities.link_plan_files on synthetic DICOM headers to show that linking RT Dose and RT Structure files to
+plans scales linearly with the number of files.
+usage: python benchmarks/bench_linking.py [file_count ...]
+"""
+
+import sys
+from os.path import dirname, join, abspath
+from time import perf_counter
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'dvh_check'))
+from utilities import link_plan_files  # noqa: E402
+
+
+def get_synthetic_tag_values(file_count):
+    # each plan has one structure set, one plan sum dose, one beam dose, every 50th plan is missing its structure set
+    tag_values = {}
+    for p in range(file_count // 4):
+        plan_uid, struct_uid = '1.2.%s.1' % p, '1.2.%s.2' % p
+        common = {'timestamp': 1558061926. + p, 'study_instance_uid': '1.2.%s' % p,
+                  'patient_name': 'ANON%05d' % p, 'rt_plan_label': 'PLAN', 'dose_summation_type': None}
+        tag_values['plan_%s.dcm' % p] = dict(common, modality='rtplan', sop_instance_uid=plan_uid,
+                                             ref_sop_instance={'type': 'struct', 'uid': struct_uid})
+        if p % 50:
+            tag_values['struct_%s.dcm' % p] = dict(common, modality='rtstruct', sop_instance_uid=struct_uid,
+                                                   ref_sop_instance={'type': None, 'uid': None})
+        for i, summation_type in enumerate(['BEAM', 'PLAN']):
+            tag_values['dose_%s_%s.dcm' % (p, i)] = dict(common, modality='rtdose', sop_instance_uid='1.2.%s.3.%s' % (p, i),
+                                                         dose_summation_type=summation_type,
+                                                         ref_sop_instance={'type': 'plan', 'uid': plan_uid})
+    return tag_values
+
+
+def main():
+    file_counts = [int(n) for n in sys.argv[1:]] or [10000, 100000]
+    for file_count in file_counts:
+        tag_values = get_synthetic_tag_values(file_count)
+        start = perf_counter()
+        dicom_files, plan_file_sets, dangling_references = link_plan_files(tag_values)
+        elapsed = perf_counter() - start
+        print('%7d files: %8.3f s, %6.2f us/file, %d plans, %d dangling references' %
+              (len(tag_values), elapsed, 1e6 * elapsed / len(tag_values), len(plan_file_sets),
+               len(dangling_references)))
+
+
+if __name__ == '__main__':
+    main()
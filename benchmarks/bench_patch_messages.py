@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Count the ColumnDataSource patch events (one websocket message each under bokeh serve) that ScoreCardView sends
+while calculating a scorecard and every plot DVH of a synthetic plan, with and without patch_aggregator.  Next tick
+callbacks are run from a queue in the order Bokeh would run them.  The resulting tables are checked to be the same.
+usage: python benchmarks/bench_patch_messages.py [protocol ...]
+"""
+
+import logging
+import queue
+import sys
+from os.path import dirname, join, abspath
+from tempfile import TemporaryDirectory
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'dvh_check'))
+sys.path.insert(0, dirname(abspath(__file__)))
+from bokeh.document import Document  # noqa: E402
+from bokeh.document.events import ColumnsPatchedEvent  # noqa: E402
+from services import SharedServices  # noqa: E402
+from view import ScoreCardView  # noqa: E402
+from synthetic_dicom import write_plan_files  # noqa: E402
+
+logging.getLogger('dicompylercore').setLevel(logging.ERROR)  # contours beyond the dose grid are expected
+
+
+class QueuedDocument(Document):
+    # runs next tick callbacks when drained rather than on a server's IOLoop
+    def __init__(self):
+        Document.__init__(self)
+        self.callbacks = queue.Queue()
+
+    def add_next_tick_callback(self, callback):
+        self.callbacks.put(callback)
+
+    def on_session_destroyed(self, *callbacks):
+        pass
+
+    def drain(self, timeout=2.):
+        while True:
+            try:
+                callback = self.callbacks.get(timeout=timeout)
+            except queue.Empty:
+                return
+            callback()
+
+
+def run(services, protocol, aggregate):
+    doc = QueuedDocument()
+    view = ScoreCardView(doc, services=services)
+    doc.add_root(view.layout)
+    if not aggregate:  # every patch is sent when it's made
+        view.table_patches.doc = view.plot_patches.doc = None
+    view.select_protocol.value = protocol
+    doc.drain()
+
+    events = []
+    doc.on_change(lambda event: events.append(event))
+    view.update_plan_options()
+    view.initialize_source_data()
+    doc.drain()
+    view.prefetch_dvhs()
+    doc.drain()
+    patches = [event for event in events if isinstance(getattr(event, 'hint', None), ColumnsPatchedEvent)]
+    services.remove_listener(view.inbox_listener)
+    return len(patches), len(events), dict(view.source_data.data)
+
+
+def main():
+    protocols = sys.argv[1:] or ['TG101']
+    with TemporaryDirectory() as directory:
+        write_plan_files(join(directory, 'inbox'))
+        services = SharedServices(inbox_dir=join(directory, 'inbox'), index_file=join(directory, 'index.db'),
+                                  dvh_cache_dir=join(directory, 'dvh_cache'),
+                                  match_cache_file=join(directory, 'match_cache.db'),
+                                  export_dir=join(directory, 'exports'))
+        for protocol in protocols:
+            results = {aggregate: run(services, protocol, aggregate) for aggregate in [False, True]}
+            rows = len(results[True][2]['roi_template'])
+            for aggregate, (patch_count, event_count, data) in results.items():
+                print('%-8s %3d rows, %-12s %4d patch events, %4d document events' %
+                      (protocol, rows, 'aggregated:' if aggregate else 'per call:', patch_count, event_count))
+            print('  identical tables: %s' % (results[True][2] == results[False][2]))
+        services.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compare the serialized size of the DVH plot's ColumnDataSource data before and after downsampling with
+plot_data.get_dvh_curves, for synthetic cumulative DVHs.
+usage: python benchmarks/bench_plot_payload.py [roi_count ...]
+"""
+
+import json
+import sys
+from os.path import dirname, join, abspath
+from time import perf_counter
+import numpy as np
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'dvh_check'))
+from bokeh.util.serialization import transform_column_source_data  # noqa: E402
+from plot_data import get_dvh_curves  # noqa: E402
+
+
+def get_synthetic_dvh_counts(roi_count, seed=0):
+    # cumulative DVHs with 1 cGy bins and max doses of 20 to 70 Gy
+    random_state = np.random.RandomState(seed)
+    dvh_counts = []
+    for _ in range(roi_count):
+        differential = random_state.rand(random_state.randint(2000, 7000))
+        dvh_counts.append(np.cumsum(differential[::-1])[::-1] * random_state.rand() * 100)
+    return dvh_counts
+
+
+def get_full_resolution_curves(dvh_counts):
+    # what the view sent before downsampling
+    xs, ys = [], []
+    for counts in dvh_counts:
+        ys.append(np.divide(counts, counts[0]))
+        xs.append(np.arange(len(counts)) / 100.)
+    return xs, ys
+
+
+def get_payload_size(xs, ys):
+    return len(json.dumps(transform_column_source_data({'x': xs, 'y': ys})))
+
+
+def main():
+    roi_counts = [int(n) for n in sys.argv[1:]] or [10, 50]
+    for roi_count in roi_counts:
+        dvh_counts = get_synthetic_dvh_counts(roi_count)
+        full_xs, full_ys = get_full_resolution_curves(dvh_counts)
+
+        start = perf_counter()
+        xs, ys = get_dvh_curves(dvh_counts)
+        elapsed = perf_counter() - start
+
+        error = max([np.max(np.abs(np.interp(full_xs[i], xs[i], ys[i]) - full_ys[i])) for i in range(roi_count)])
+        print('%3d ROIs: full resolution %8.1f KB, downsampled %6.1f KB in %5.1f ms, max volume error %.4f' %
+              (roi_count, get_payload_size(full_xs, full_ys) / 1024., get_payload_size(xs, ys) / 1024.,
+               1e3 * elapsed, error))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Check that dvh_engine's worker processes can calculate DVHs when the app directory isn't on sys.path once the pool
+starts, as under bokeh serve, which only adds it while main.py runs.  The DVHs are compared with those calculated in
+this process.  Exits with status 1 on failure.
+usage: python benchmarks/check_dvh_workers.py
+"""
+
+import importlib
+import logging
+import sys
+from os.path import dirname, join, abspath
+from tempfile import TemporaryDirectory
+import numpy as np
+
+APP_DIR = join(dirname(dirname(abspath(__file__))), 'dvh_check')
+sys.path.insert(0, dirname(abspath(__file__)))
+from dicompylercore import dicomparser  # noqa: E402
+from synthetic_dicom import write_plan_files  # noqa: E402
+
+logging.getLogger('dicompylercore').setLevel(logging.ERROR)  # contours beyond the dose grid are expected
+
+
+def main():
+    # imported here rather than at the top, since the workers run this module again as __mp_main__
+    sys.path.insert(0, APP_DIR)
+    dvh_engine = importlib.import_module('dvh_engine')
+    sys.path.remove(APP_DIR)
+    with TemporaryDirectory() as directory:
+        files = write_plan_files(directory)
+        roi_keys = list(dicomparser.DicomParser(files['rtstruct']).GetStructures())
+        expected = dict(dvh_engine.calculate_dvhs(files['rtstruct'], files['rtdose'], roi_keys, workers=1))
+        try:
+            dvhs = dict(dvh_engine.calculate_dvhs(files['rtstruct'], files['rtdose'], roi_keys, workers=2))
+        except Exception as e:
+            print('%s workers failed: %r' % (dvh_engine.WORKER_START_METHOD, e))
+            sys.exit(1)
+    identical = all(np.array_equal(expected[key].counts, dvhs[key].counts) for key in roi_keys)
+    print('%s workers, %d DVHs, identical: %s' % (dvh_engine.WORKER_START_METHOD, len(dvhs), identical))
+    if not identical:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
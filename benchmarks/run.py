@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite for the scan -> match -> DVH -> evaluate pipeline, run headless.  The inbox is the bundled
+dvh-check/test_files plus a synthetic plan, cloned with new UIDs.  The bundled plans have no structure sets, so every
+file is scanned but the complete plans (the synthetic ones) are matched against aliases.csv plus synthetic template
+ROIs and evaluated against synthetic protocols.  Each stage is timed over
+--repeat runs, then run once more under tracemalloc for its peak Python heap.  Results are written as JSON so runs
+of different versions can be compared.
+usage: python benchmarks/run.py [--copies N] [--templates N] [--protocols N] [--dvh-plans N] [--repeat N]
+                                [--output results.json]
+"""
+
+import argparse
+import json
+import logging
+import platform
+import random
+import resource
+import sys
+import tracemalloc
+from os import makedirs
+from os.path import dirname, join, abspath, isdir
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter, time
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'dvh_check'))
+sys.path.insert(0, dirname(abspath(__file__)))
+import numpy as np  # noqa: E402
+from dicompylercore import __version__ as dicompyler_version, dvhcalc  # noqa: E402
+import dvh_stream  # noqa: E402
+from utilities import DicomDirectoryParser, get_file_paths  # noqa: E402
+from protocols import Protocols, ProtocolRegistry  # noqa: E402
+from structure_aliases import StructureAliases  # noqa: E402
+from dicom_cache import DicomCache  # noqa: E402
+from dvh_engine import calculate_dvhs  # noqa: E402
+from scorecard import get_roi_keys, match_rois, calculate_constraint, get_pass_fail  # noqa: E402
+from scorecard import get_dvh_stack, evaluate_constraints  # noqa: E402
+from synthetic_dicom import write_plan_files, clone_files  # noqa: E402
+
+BENCHMARK_VERSION = 2
+TEST_FILES_DIR = join(dirname(dirname(abspath(__file__))), 'dvh-check', 'test_files')
+SEED = 0
+WORDS = ['Lung', 'Heart', 'Cord', 'Spinal', 'PTV', 'CTV', 'GTV', 'Bowel', 'Liver', 'Kidney', 'Eso', 'Brain',
+         'Stem', 'L', 'R', '_', ' ', '50', '60', 'opt', 'Ring', 'Rectum', 'Bladder']
+CONSTRAINTS = ['D_max', 'Mean', 'D_5', 'D_0.35', 'D_50%', 'V_20', 'V_12.4', 'MVS_11']
+
+logging.getLogger('dicompylercore').setLevel(logging.ERROR)  # contours beyond the dose grid are expected
+
+
+def get_random_name():
+    return ''.join(random.choice(WORDS) for _ in range(random.randint(1, 4)))
+
+
+def get_base_files(directory):
+    # returns (bundled test files, synthetic plan files written to directory)
+    bundled_files = get_file_paths(TEST_FILES_DIR) if isdir(TEST_FILES_DIR) else []
+    return bundled_files, list(write_plan_files(join(directory, 'base')).values())
+
+
+def write_inbox(directory, base_files, copies):
+    for copy in range(copies):
+        clone_files(base_files, join(directory, 'inbox', '%04d' % copy), copy, patient_name='BENCH%04d' % copy)
+    return join(directory, 'inbox')
+
+
+def get_synthetic_aliases(template_count):
+    aliases = StructureAliases()
+    for i in range(template_count):
+        aliases.add_template_roi('T%d %s' % (i, get_random_name()),
+                                 sorted(set(get_random_name() for _ in range(random.randint(0, 8)))))
+    return aliases
+
+
+def write_protocols(directory, protocol_count, template_rois, synthetic_rois):
+    # each protocol constrains up to 10 of template_rois (the templates the plan ROIs match) and 10 synthetic ROIs
+    protocol_dir = join(directory, 'protocols')
+    makedirs(protocol_dir, exist_ok=True)
+    for p in range(protocol_count):
+        with open(join(protocol_dir, 'BENCH%03d_3Fx.scp' % p), 'w') as document:
+            document.write('# Description: synthetic benchmark protocol\n')
+            rois = random.sample(template_rois, min(10, len(template_rois))) + \
+                random.sample(synthetic_rois, min(10, len(synthetic_rois)))
+            for roi in rois:
+                document.write('%s\n' % roi)
+                for constraint in random.sample(CONSTRAINTS, 2):
+                    document.write('    %s   %s\n' % (constraint, round(random.uniform(5., 40.), 1)))
+    return Protocols(registry=ProtocolRegistry(protocol_dir=protocol_dir))
+
+
+def measure(func, repeat):
+    # returns (last result, {seconds, median, repeat, peak_mb}), timings exclude the tracemalloc run
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        result = func()
+        times.append(perf_counter() - start)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, {'seconds': min(times), 'median': median(times), 'repeat': repeat, 'peak_mb': peak / 1024. ** 2}
+
+
+def run(args, directory):
+    random.seed(SEED)
+    results = {}
+
+    def add_stage(name, func, items, repeat=args.repeat):
+        result, stats = measure(func, repeat)
+        results[name] = dict(stats, items=items)
+        print('%-16s %9.4f s (median %9.4f s), peak %8.1f MB, %d items' %
+              (name, stats['seconds'], stats['median'], stats['peak_mb'], items), file=sys.stderr)
+        return result
+
+    bundled_files, synthetic_files = get_base_files(directory)
+    inbox = write_inbox(directory, bundled_files + synthetic_files, args.copies)
+    file_count = len(get_file_paths(inbox))
+
+    # scan: the first run builds the header index, later runs only stat the files
+    index_files = iter(join(directory, 'index_%d.db' % i) for i in range(args.repeat + 1))
+    add_stage('scan_cold', lambda: DicomDirectoryParser(inbox, index_file=next(index_files), workers=args.workers),
+              file_count)
+    index_file = join(directory, 'index.db')
+    DicomDirectoryParser(inbox, index_file=index_file)  # builds the index
+    parser = add_stage('scan_indexed', lambda: DicomDirectoryParser(inbox, index_file=index_file,
+                                                                    workers=args.workers), file_count)
+    plan_names = parser.plan_names
+
+    # match: every plan against every protocol, with a cold alias index
+    dicom_cache = DicomCache()
+    structures = {plan: dicom_cache.get_parser(parser.plan_file_sets[plan]['rtstruct']['file_path']).GetStructures()
+                  for plan in plan_names}
+    aliases = get_synthetic_aliases(args.templates)
+    plan_rois = sorted({str(s['name']) for plan in plan_names for s in structures[plan].values()})
+    template_rois = sorted({match[0] for match in StructureAliases().get_best_template_roi_matches(plan_rois)
+                            if match[0] is not None})
+    synthetic_rois = [roi for roi in aliases.template_rois if roi.startswith('T') and roi not in template_rois]
+    protocols = write_protocols(directory, args.protocols, template_rois, synthetic_rois)
+    column_data = {name: protocols.get_column_data(name, '3Fx') for name in protocols.protocol_names}
+
+    def build_index():
+        aliases.index = None
+        return aliases.alias_index
+
+    add_stage('alias_index', build_index, len(aliases.all_rois))
+
+    def match():
+        return {(plan, name): match_rois(aliases, data['roi_template'], structures[plan])
+                for plan in plan_names for name, data in column_data.items()}
+
+    matched = add_stage('match', match, len(plan_names) * len(column_data))
+
+    # DVHs: every ROI of the first --dvh-plans plans, as the plot's prefetch does, dicompyler's dvhcalc against
+    # the engine
+    dvh_plans = plan_names[:args.dvh_plans]
+    roi_keys = {plan: get_roi_keys(structures[plan]) for plan in dvh_plans}
+    dvh_count = sum([len(keys) for keys in roi_keys.values()])
+
+    def get_files(plan):
+        return parser.plan_file_sets[plan]['rtstruct']['file_path'], parser.plan_file_sets[plan]['rtdose']['file_path']
+
+    def calculate_dvhcalc():
+        return {plan: {key: dvhcalc.get_dvh(dicom_cache.get_dataset(get_files(plan)[0]), get_files(plan)[1], key)
+                       for key in roi_keys[plan]} for plan in dvh_plans}
+
+    def calculate_engine():
+        dvh_stream._get_dose_grid.cache_clear()  # every run maps the dose grid again
+        return {plan: dict(calculate_dvhs(*get_files(plan), roi_keys[plan], workers=1, dicom_cache=dicom_cache))
+                for plan in dvh_plans}
+
+    expected = add_stage('dvh_dvhcalc', calculate_dvhcalc, dvh_count, repeat=1)
+    dvhs = add_stage('dvh_engine', calculate_engine, dvh_count)
+    identical = all(np.array_equal(expected[plan][key].counts, dvhs[plan][key].counts)
+                    for plan in dvh_plans for key in roi_keys[plan])
+
+    # evaluate: every constraint row of every protocol, one row at a time as the view does and vectorized as the
+    # batch mode does
+    rows = [(plan, name, i) for plan in dvh_plans for name in column_data
+            for i in range(len(column_data[name]['roi_template']))]
+
+    def evaluate_rows():
+        results = []
+        for plan, name, i in rows:
+            key = matched[(plan, name)][i][1]
+            if key:
+                data = column_data[name]
+                value = calculate_constraint(dvhs[plan][key], data['calc_type'][i], data['input_value'][i])
+                results.append(get_pass_fail(value, data['operator'][i], data['threshold_value'][i]))
+        return results
+
+    def evaluate_matrix():
+        results = []
+        for plan in dvh_plans:
+            keys = roi_keys[plan]
+            dvh_stack, lengths, bin_width = get_dvh_stack([dvhs[plan][key] for key in keys])
+            for name, data in column_data.items():
+                roi_index = [keys.index(key) if key else -1 for roi_name, key in matched[(plan, name)]]
+                results.append(evaluate_constraints(data, dvh_stack, lengths, roi_index, bin_width))
+        return results
+
+    add_stage('evaluate_rows', evaluate_rows, len(rows))
+    add_stage('evaluate_matrix', evaluate_matrix, len(rows))
+
+    return {'benchmark_version': BENCHMARK_VERSION,
+            'created': time(),
+            'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                            'numpy': np.__version__, 'dicompyler-core': dicompyler_version},
+            'parameters': {'copies': args.copies, 'templates': args.templates, 'protocols': args.protocols,
+                           'dvh_plans': args.dvh_plans, 'repeat': args.repeat, 'workers': args.workers,
+                           'files': file_count, 'plans': len(plan_names), 'bundled_files': len(bundled_files)},
+            'stages': results,
+            'identical_dvhs': identical,
+            'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the scorecard pipeline')
+    parser.add_argument('--copies', type=int, default=20, help='Copies of the base plan in the synthetic inbox')
+    parser.add_argument('--templates', type=int, default=1000, help='Synthetic template ROIs added to aliases.csv')
+    parser.add_argument('--protocols', type=int, default=10, help='Synthetic protocols')
+    parser.add_argument('--dvh-plans', dest='dvh_plans', type=int, default=1, help='Plans to calculate DVHs for')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per stage')
+    parser.add_argument('--workers', type=int, default=8, help='Threads used to scan the inbox')
+    parser.add_argument('--output', default=None, help='JSON results file, printed if not provided')
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as directory:
+        results = run(args, directory)
+
+    if args.output:
+        with open(args.output, 'w') as document:
+            json.dump(results, document, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
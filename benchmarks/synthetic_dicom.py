@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Write synthetic RT Plan, RT Structure Set, and RT Dose files for the benchmarks.  The dose is a smooth blob
+centered on the PTV and the structures are stacks of circular contours.  Existing plans can also be cloned with
+new UIDs to build large inboxes.
+"""
+
+import numpy as np
+from os import makedirs
+from os.path import join, basename
+import pydicom
+from pydicom.dataset import Dataset, FileDataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import generate_uid, ImplicitVRLittleEndian
+
+RTPLAN_CLASS = '1.2.840.10008.5.1.4.1.1.481.5'
+RTSTRUCT_CLASS = '1.2.840.10008.5.1.4.1.1.481.3'
+RTDOSE_CLASS = '1.2.840.10008.5.1.4.1.1.481.2'
+
+# name, center (x, y) in mm, radius in mm, z range in mm, RT ROI Interpreted Type
+DEFAULT_ROIS = [('SpinalCord', (0., 60.), 8., (-120., 120.), 'ORGAN'),
+                ('Lung_L', (70., 0.), 45., (-90., 90.), 'ORGAN'),
+                ('Lung_R', (-70., 0.), 45., (-90., 90.), 'ORGAN'),
+                ('Heart', (-20., -20.), 40., (-60., 20.), 'ORGAN'),
+                ('Esophagus', (5., 35.), 7., (-140., 140.), 'ORGAN'),
+                ('PTV_5000', (30., 10.), 25., (-25., 25.), 'PTV'),
+                ('BB', (0., -100.), 2., (-2., 2.), 'MARKER')]
+
+
+def new_dataset(file_path, sop_class_uid, modality, study_uid, patient_name):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = sop_class_uid
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ImplicitVRLittleEndian
+    ds = FileDataset(file_path, {}, file_meta=meta, preamble=b'\0' * 128)
+    ds.is_little_endian, ds.is_implicit_VR = True, True
+    ds.SOPClassUID, ds.SOPInstanceUID = sop_class_uid, meta.MediaStorageSOPInstanceUID
+    ds.Modality, ds.StudyInstanceUID, ds.PatientName = modality, study_uid, patient_name
+    ds.PatientID = patient_name
+    return ds
+
+
+def write_rtstruct(file_path, study_uid, patient_name, rois=None, slice_thickness=3., points=48):
+    ds = new_dataset(file_path, RTSTRUCT_CLASS, 'RTSTRUCT', study_uid, patient_name)
+    roi_sequence, contour_sequence, observation_sequence = Sequence(), Sequence(), Sequence()
+    theta = np.linspace(0., 2 * np.pi, points, endpoint=False)
+    for number, (name, center, radius, (z_min, z_max), roi_type) in enumerate(rois or DEFAULT_ROIS, 1):
+        roi = Dataset()
+        roi.ROINumber, roi.ROIName = number, name
+        roi_sequence.append(roi)
+
+        observation = Dataset()
+        observation.ReferencedROINumber, observation.ROIObservationLabel = number, name
+        observation.RTROIInterpretedType = roi_type
+        observation_sequence.append(observation)
+
+        roi_contour = Dataset()
+        roi_contour.ReferencedROINumber, roi_contour.ROIDisplayColor = number, [255, 0, 0]
+        roi_contour.ContourSequence = Sequence()
+        for z in np.arange(z_min, z_max + slice_thickness / 2, slice_thickness):
+            xyz = np.c_[center[0] + radius * np.cos(theta), center[1] + radius * np.sin(theta), np.full(points, z)]
+            contour = Dataset()
+            contour.ContourGeometricType, contour.NumberOfContourPoints = 'CLOSED_PLANAR', points
+            contour.ContourData = [round(float(v), 2) for v in xyz.ravel()]
+            roi_contour.ContourSequence.append(contour)
+        contour_sequence.append(roi_contour)
+
+    ds.StructureSetROISequence = roi_sequence
+    ds.ROIContourSequence = contour_sequence
+    ds.RTROIObservationsSequence = observation_sequence
+    ds.save_as(file_path, write_like_original=False)
+    return ds.SOPInstanceUID
+
+
+def write_rtplan(file_path, study_uid, patient_name, rtstruct_uid, label='TG101 SBRT', fractions=3):
+    ds = new_dataset(file_path, RTPLAN_CLASS, 'RTPLAN', study_uid, patient_name)
+    ds.RTPlanLabel = label
+    referenced_structure_set = Dataset()
+    referenced_structure_set.ReferencedSOPClassUID = RTSTRUCT_CLASS
+    referenced_structure_set.ReferencedSOPInstanceUID = rtstruct_uid
+    ds.ReferencedStructureSetSequence = Sequence([referenced_structure_set])
+    fraction_group = Dataset()
+    fraction_group.FractionGroupNumber, fraction_group.NumberOfFractionsPlanned = 1, fractions
+    ds.FractionGroupSequence = Sequence([fraction_group])
+    ds.save_as(file_path, write_like_original=False)
+    return ds.SOPInstanceUID
+
+
+def write_rtdose(file_path, study_uid, patient_name, rtplan_uid, shape=(100, 128, 128), spacing=(3., 2.5, 2.5),
+                 max_dose=60., center=(30., 10., 0.), summation_type='PLAN'):
+    # shape is (frames, rows, columns), spacing is (frame offset, row spacing, column spacing) in mm
+    ds = new_dataset(file_path, RTDOSE_CLASS, 'RTDOSE', study_uid, patient_name)
+    frames, rows, columns = shape
+    origin = [-(columns - 1) * spacing[2] / 2, -(rows - 1) * spacing[1] / 2, -(frames - 1) * spacing[0] / 2]
+    ds.ImagePositionPatient = origin
+    ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+    ds.PatientPosition = 'HFS'
+    ds.PixelSpacing = [spacing[1], spacing[2]]
+    ds.GridFrameOffsetVector = [i * spacing[0] for i in range(frames)]
+    ds.FrameIncrementPointer = (0x3004, 0x000C)
+    ds.NumberOfFrames, ds.Rows, ds.Columns = frames, rows, columns
+    ds.SamplesPerPixel, ds.PhotometricInterpretation = 1, 'MONOCHROME2'
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 32, 32, 31, 0
+    ds.DoseUnits, ds.DoseType, ds.DoseSummationType = 'GY', 'PHYSICAL', summation_type
+    ds.DoseGridScaling = max_dose / 2 ** 24
+    referenced_plan = Dataset()
+    referenced_plan.ReferencedSOPClassUID, referenced_plan.ReferencedSOPInstanceUID = RTPLAN_CLASS, rtplan_uid
+    ds.ReferencedRTPlanSequence = Sequence([referenced_plan])
+
+    # written one frame at a time so large grids don't need to fit in memory here either
+    x = origin[0] + spacing[2] * np.arange(columns) - center[0]
+    y = origin[1] + spacing[1] * np.arange(rows) - center[1]
+    xy = (x[np.newaxis, :] ** 2 + y[:, np.newaxis] ** 2) / (2 * 40. ** 2)
+    ds.PixelData = b''
+    ds.save_as(file_path, write_like_original=False)
+    with open(file_path, 'r+b') as fp:
+        fp.seek(-4, 2)  # replace the empty Pixel Data length
+        fp.write(np.uint32(frames * rows * columns * 4).tobytes())
+        for f in range(frames):
+            z = origin[2] + spacing[0] * f - center[2]
+            plane = np.exp(-(xy + z ** 2 / (2 * 40. ** 2))) * (2 ** 24 - 1)
+            fp.write(plane.astype('<u4').tobytes())
+    return ds.SOPInstanceUID
+
+
+def write_plan_files(directory, name='SYNTH', dose_shape=(100, 128, 128), rois=None, label='TG101 SBRT',
+                     fractions=3):
+    # returns {'rtplan': file_path, 'rtstruct': file_path, 'rtdose': file_path}
+    makedirs(directory, exist_ok=True)
+    study_uid = generate_uid()
+    files = {key: join(directory, '%s_%s.dcm' % (name, key)) for key in ['rtplan', 'rtstruct', 'rtdose']}
+    rtstruct_uid = write_rtstruct(files['rtstruct'], study_uid, name, rois=rois)
+    rtplan_uid = write_rtplan(files['rtplan'], study_uid, name, rtstruct_uid, label=label, fractions=fractions)
+    write_rtdose(files['rtdose'], study_uid, name, rtplan_uid, shape=dose_shape)
+    return files
+
+
+def clone_files(file_paths, directory, copy, patient_name=None):
+    # Writes copy number copy of file_paths to directory with every instance, series, study, and frame of reference
+    # UID replaced, references between the files are rewritten consistently.  UIDs are derived from the original
+    # UID and the copy number, so clones are the same from run to run.  Returns the new file paths.
+    makedirs(directory, exist_ok=True)
+    uids = {}
+
+    def get_uid(uid):
+        if uid not in uids:
+            uids[uid] = generate_uid(entropy_srcs=[str(uid), str(copy)])
+        return uids[uid]
+
+    def replace_uids(dataset, element):
+        if element.VR == 'UI' and element.value and not element.keyword.endswith('ClassUID') and \
+                element.keyword != 'TransferSyntaxUID':
+            element.value = get_uid(element.value)
+
+    clones = []
+    for file_path in file_paths:
+        ds = pydicom.read_file(file_path)
+        ds.walk(replace_uids)
+        ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
+        if patient_name is not None:
+            ds.PatientName = ds.PatientID = patient_name
+        clone = join(directory, '%s_%s' % (copy, basename(file_path)))
+        ds.save_as(clone)
+        clones.append(clone)
+    return clones
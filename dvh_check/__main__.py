@@ -7,6 +7,7 @@ This is the main python file for command line implementation.
 """
 
 import os
+import sys
 from subprocess import call
 import argparse
 # from utilities import save_ip_and_port, load_ip_and_port, initialize_directories_settings
@@ -32,8 +33,59 @@ def main():
     #                     dest='save_ip_and_port',
     #                     default=False,
     #                     action='store_true')
+
+    subparsers = parser.add_subparsers(dest='command')
+    batch_parser = subparsers.add_parser('batch', help='Evaluate every plan in a directory without the Bokeh app')
+    batch_parser.add_argument('start_path',
+                              help='Directory to search for RT Plan, RT Structure, and RT Dose files')
+    batch_parser.add_argument('--protocol',
+                              dest='protocol',
+                              help='Protocol name, detected from the plan label if not provided',
+                              default=None)
+    batch_parser.add_argument('--fx',
+                              dest='fractionation',
+                              help='Number of fractions, read from the plan if not provided',
+                              default=None)
+    batch_parser.add_argument('--output',
+                              dest='output',
+                              help='Results file, JSON if it ends with .json, CSV otherwise',
+                              default='scorecards.csv')
+    batch_parser.add_argument('--workers',
+                              dest='workers',
+                              help='Number of worker processes',
+                              type=int,
+                              default=os.cpu_count())
+    batch_parser.add_argument('--index-file',
+                              dest='index_file',
+                              help='DICOM header index file, speeds up repeated runs on the same directory',
+                              default=None)
+    batch_parser.add_argument('--export',
+                              dest='export_dir',
+                              help='Directory to append scorecard rows and DVHs to as compressed .npz parts',
+                              default=None)
     args = parser.parse_args()
 
+    if args.command == 'batch':
+        batch(args)
+    else:
+        serve(args)
+
+
+def batch(args):
+    # Modules in SCRIPT_DIR import each other the same way they do under bokeh serve
+    sys.path.insert(0, SCRIPT_DIR)
+    from batch import run_batch
+
+    rows = run_batch(args.start_path, args.output, protocol=args.protocol, fractionation=args.fractionation,
+                     workers=args.workers, index_file=args.index_file, export_dir=args.export_dir)
+    plans = {row['plan'] for row in rows}
+    errors = {row['plan'] for row in rows if row.get('error')}
+    failures = {row['plan'] for row in rows if row.get('pass_fail') == 'Fail'}
+    print("%s plans evaluated, %s with failed constraints, %s could not be evaluated. Results written to %s" %
+          (len(plans), len(failures), len(errors), args.output))
+
+
+def serve(args):
     command = ["bokeh", "serve"]
 
     # ip_and_port = load_ip_and_port()
@@ -46,9 +98,8 @@ def main():
     if args.port:
         port = args.port
 
-    if args.save_ip_and_port:
-        # save_ip_and_port({'host': host, 'port': port})
-        pass
+    # if args.save_ip_and_port:
+    #     save_ip_and_port({'host': host, 'port': port})
 
     command.append("--allow-websocket-origin")
     command.append("%s:%s" % (host, port))
@@ -0,0 +1,132 @@
+import csv
+import json
+from os import cpu_count
+from os.path import splitext
+import pydicom as dicom
+from protocols import Protocols
+from structure_aliases import StructureAliases
+from utilities import DicomDirectoryParser, pool_map
+from dicom_cache import DicomCache
+from dvh_cache import DVHCache
+from match_cache import MatchCache
+from export import ResultsExport
+from dvh_engine import calculate_dvhs
+from scorecard import match_rois, get_dvh_stack, get_dvh_statistics, evaluate_constraints
+from paths import DVH_CACHE_DIR, MATCH_CACHE_FILE
+
+DEFAULT_PROTOCOL = 'TG101'
+BATCH_WORKERS = cpu_count() or 1  # processes, each evaluates one plan at a time
+COLUMNS = ['plan', 'protocol', 'fractionation', 'roi_template', 'roi_name', 'roi_key', 'volume', 'min_dose',
+           'mean_dose', 'max_dose', 'constraint', 'constraint_calc', 'pass_fail', 'error']
+
+# loaded once per worker process
+_protocols = None
+_aliases = None
+
+
+def get_plan_protocol(plan_file, protocols, protocol=None, fractionation=None):
+    # Without a protocol, use the longest protocol name found in the plan label or name, otherwise DEFAULT_PROTOCOL
+    # Without a fractionation, use the number of fractions planned
+    ds = dicom.read_file(plan_file, stop_before_pixels=True)
+    if protocol is None:
+        label = ('%s %s' % (ds.get('RTPlanLabel', ''), ds.get('RTPlanName', ''))).lower()
+        matches = [name for name in protocols.protocol_names if name.lower() in label]
+        protocol = max(matches, key=len) if matches else DEFAULT_PROTOCOL
+    if fractionation is None:
+        fractionation = str(ds.FractionGroupSequence[0].NumberOfFractionsPlanned)
+    return protocol, str(fractionation)
+
+
+def evaluate_plan(plan_name, plan_file_set, protocol=None, fractionation=None):
+    global _protocols, _aliases
+    if _protocols is None:
+        _protocols, _aliases = Protocols(), StructureAliases(match_cache=MatchCache(MATCH_CACHE_FILE))
+
+    try:
+        protocol, fractionation = get_plan_protocol(plan_file_set['rtplan']['file_path'], _protocols,
+                                                    protocol=protocol, fractionation=fractionation)
+        if protocol not in _protocols.protocol_names or fractionation not in _protocols.get_fractionations(protocol):
+            raise ValueError("No protocol found for %s with %s fractions" % (protocol, fractionation))
+        data = _protocols.get_column_data(protocol, '%sFx' % fractionation)
+
+        rtstruct, rtdose = plan_file_set['rtstruct'], plan_file_set['rtdose']
+        dicom_cache = DicomCache()  # only this plan's files, released when the plan is done
+        structures = dicom_cache.get_parser(rtstruct['file_path']).GetStructures()
+        matched_rows = match_rois(_aliases, data['roi_template'], structures)
+
+        dvh_cache = DVHCache(DVH_CACHE_DIR)
+        dvhs = {}
+        uncached_keys = []
+        for key in {key for roi_name, key in matched_rows if key}:
+            dvhs[key] = dvh_cache.get(rtstruct['sop_instance_uid'], rtdose['sop_instance_uid'], key)
+            if dvhs[key] is None:
+                uncached_keys.append(key)
+        for key, dvh in calculate_dvhs(rtstruct['file_path'], rtdose['file_path'], uncached_keys, workers=1,
+                                       dicom_cache=dicom_cache):
+            dvhs[key] = dvh
+            dvh_cache.set(rtstruct['sop_instance_uid'], rtdose['sop_instance_uid'], key, dvh)
+
+        # every constraint of the plan is evaluated in one pass over the stacked DVHs
+        keys = list(dvhs)
+        dvh_stack, lengths, bin_width = get_dvh_stack([dvhs[key] for key in keys])
+        roi_index = [keys.index(key) if key else -1 for roi_name, key in matched_rows]
+        statistics = {column: values.tolist() for column, values in
+                      get_dvh_statistics(dvh_stack, lengths, bin_width).items()}
+        values, pass_fail = evaluate_constraints(data, dvh_stack, lengths, roi_index, bin_width)
+
+        rows = []
+        for i, (roi_name, key) in enumerate(matched_rows):
+            row = {'plan': plan_name, 'protocol': protocol, 'fractionation': fractionation,
+                   'roi_template': data['roi_template'][i], 'roi_name': roi_name, 'roi_key': key,
+                   'constraint': data['string_rep'][i]}
+            if key:
+                row.update({column: statistics[column][roi_index[i]] for column in statistics})
+                row.update({'constraint_calc': float(values[i]), 'pass_fail': str(pass_fail[i])})
+            rows.append(row)
+        return rows
+
+    except Exception as e:  # report the plan as an error row rather than stop the whole batch
+        return [{'plan': plan_name, 'protocol': protocol, 'fractionation': fractionation, 'error': str(e)}]
+
+
+def run_batch(start_path, output_file, protocol=None, fractionation=None, workers=BATCH_WORKERS, index_file=None,
+              export_dir=None):
+    parser = DicomDirectoryParser(start_path, index_file=index_file, workers=workers)
+    plan_names = parser.plan_names
+    count = len(plan_names)
+    results = pool_map(evaluate_plan, plan_names, [parser.plan_file_sets[name] for name in plan_names],
+                       [protocol] * count, [fractionation] * count, workers=workers, use_processes=True)
+    rows = [row for plan_rows in results for row in plan_rows]
+    write_results(rows, output_file)
+    if export_dir:
+        export_results(rows, parser.plan_file_sets, ResultsExport(export_dir))
+    return rows
+
+
+def export_results(rows, plan_file_sets, results_export):
+    # DVHs are read back from the DVH cache the workers wrote them to
+    dvh_cache = DVHCache(DVH_CACHE_DIR)
+    export_rows, dvhs, exported = [], [], set()
+    for row in rows:
+        plan_file_set = plan_file_sets[row['plan']]
+        plan_uid = plan_file_set['rtplan']['sop_instance_uid']
+        export_rows.append(dict(row, plan_uid=plan_uid))
+        key = row.get('roi_key')
+        if key and (plan_uid, key) not in exported:
+            exported.add((plan_uid, key))
+            dvh = dvh_cache.get(plan_file_set['rtstruct']['sop_instance_uid'],
+                                plan_file_set['rtdose']['sop_instance_uid'], key)
+            if dvh is not None:
+                dvhs.append((plan_uid, key, dvh))
+    return results_export.append(export_rows, dvhs)
+
+
+def write_results(rows, output_file):
+    if splitext(output_file)[1].lower() == '.json':
+        with open(output_file, 'w') as document:
+            json.dump(rows, document, indent=2)
+    else:
+        with open(output_file, 'w', newline='') as document:
+            writer = csv.DictWriter(document, fieldnames=COLUMNS, restval='')
+            writer.writeheader()
+            writer.writerows(rows)
@@ -0,0 +1,58 @@
+from collections import OrderedDict
+from os.path import getmtime, getsize
+from threading import Lock
+from dicompylercore import dicomparser
+from metrics import count, timed
+
+MAX_CACHE_SIZE = 1024 ** 3  # bytes, approximate memory held by cached DICOM objects before the oldest are evicted
+
+
+# LRU cache of parsed DicomParser objects keyed by file path (and mtime, so a replaced file is parsed again).
+# RT Dose pixel data is decoded when cached, pydicom keeps the array on the dataset so later DVH calculations
+# reuse the decoded dose grid.
+class DicomCache:
+    def __init__(self, max_size=MAX_CACHE_SIZE):
+        self.max_size = max_size
+        self.data = OrderedDict()  # file_path: (mtime, parser, size)
+        self.size = 0
+        self.lock = Lock()
+
+    def get_parser(self, file_path):
+        mtime = getmtime(file_path)
+        with self.lock:
+            if file_path in self.data and self.data[file_path][0] == mtime:
+                self.data.move_to_end(file_path)
+                count('dicom_cache.hit')
+                return self.data[file_path][1]
+
+        count('dicom_cache.miss')
+        parser = parse_dicom_file(file_path)
+        size = getsize(file_path)
+        if parser.ds.Modality == 'RTDOSE':
+            size += parser.ds.pixel_array.nbytes
+
+        with self.lock:
+            self.__remove(file_path)
+            self.data[file_path] = (mtime, parser, size)
+            self.size += size
+            while self.size > self.max_size and len(self.data) > 1:
+                self.__remove(next(iter(self.data)))
+
+        return parser
+
+    def get_dataset(self, file_path):
+        return self.get_parser(file_path).ds
+
+    def __remove(self, file_path):
+        if file_path in self.data:
+            self.size -= self.data.pop(file_path)[2]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.size = 0
+
+
+@timed('parse_dicom_file')
+def parse_dicom_file(file_path):
+    return dicomparser.DicomParser(file_path)
@@ -0,0 +1,58 @@
+import sqlite3
+
+# Bump when the stored columns change, an index written by an older version is discarded and rebuilt
+INDEX_VERSION = 2
+TAG_COLUMNS = ['modality', 'study_instance_uid', 'sop_instance_uid', 'patient_name', 'rt_plan_label',
+               'dose_summation_type', 'ref_type', 'ref_uid']
+
+
+# On-disk cache of the DICOM tags collected by DicomDirectoryParser, keyed by file path, size, and mtime
+class DicomIndex:
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self.connection = sqlite3.connect(index_file)
+        self.__initialize()
+
+    def __initialize(self):
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != INDEX_VERSION:
+            self.connection.execute('DROP TABLE IF EXISTS dicom_files')
+        columns = ', '.join(['%s TEXT' % column for column in TAG_COLUMNS])
+        self.connection.execute('CREATE TABLE IF NOT EXISTS dicom_files '
+                                '(file_path TEXT PRIMARY KEY, size INTEGER, mtime REAL, %s)' % columns)
+        self.connection.execute('PRAGMA user_version = %d' % INDEX_VERSION)
+        self.connection.commit()
+
+    def load(self):
+        # returns {file_path: (size, mtime, tag_values)}, tag_values is None for files that are not DICOM
+        query = 'SELECT file_path, size, mtime, %s FROM dicom_files' % ', '.join(TAG_COLUMNS)
+        return {row[0]: (row[1], row[2], self.row_to_tag_values(row[2], row[3:]))
+                for row in self.connection.execute(query)}
+
+    @staticmethod
+    def row_to_tag_values(mtime, row):
+        values = dict(zip(TAG_COLUMNS, row))
+        if values['modality'] is None:
+            return None
+        ref_type, ref_uid = values.pop('ref_type'), values.pop('ref_uid')
+        values['ref_sop_instance'] = {'type': ref_type, 'uid': ref_uid}
+        values['timestamp'] = mtime
+        return values
+
+    def update(self, file_path, size, mtime, tag_values):
+        if tag_values is None:
+            row = [None] * len(TAG_COLUMNS)
+        else:
+            row = [tag_values.get(column) for column in TAG_COLUMNS[:-2]] + \
+                  [tag_values['ref_sop_instance']['type'], tag_values['ref_sop_instance']['uid']]
+        self.connection.execute('INSERT OR REPLACE INTO dicom_files VALUES (%s)' % ', '.join(['?'] * (len(row) + 3)),
+                                [file_path, size, mtime] + row)
+
+    def remove(self, file_paths):
+        self.connection.executemany('DELETE FROM dicom_files WHERE file_path = ?', [(f,) for f in file_paths])
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,62 @@
+import hashlib
+import logging
+import numpy as np
+from os import makedirs, replace, remove, fdopen
+from os.path import join, isfile
+from tempfile import mkstemp
+from dicompylercore import __version__ as dicompyler_version
+from dicompylercore.dvh import DVH
+from metrics import count
+
+CACHE_VERSION = 1
+DVH_CALC_SETTINGS = {}  # keyword arguments passed to dvhcalc.get_dvh, DVHs are cached per settings
+
+logger = logging.getLogger('dvh_check.dvh_cache')
+
+
+# Disk-backed cache of cumulative DVHs.  A DVH only depends on the structure set, the dose grid, the ROI, and the
+# calculation settings, so it is keyed by (rtstruct SOP UID, rtdose SOP UID, ROI key, settings) and stored as a
+# compressed .npz of counts (cm3) and the dose bin width (Gy)
+class DVHCache:
+    def __init__(self, cache_dir, settings=None):
+        self.cache_dir = cache_dir
+        self.settings = DVH_CALC_SETTINGS if settings is None else settings
+        makedirs(cache_dir, exist_ok=True)
+
+    def get_file_path(self, rtstruct_uid, rtdose_uid, roi_key):
+        key = repr((CACHE_VERSION, dicompyler_version, rtstruct_uid, rtdose_uid, str(roi_key),
+                    sorted(self.settings.items())))
+        return join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.npz')
+
+    def get(self, rtstruct_uid, rtdose_uid, roi_key):
+        file_path = self.get_file_path(rtstruct_uid, rtdose_uid, roi_key)
+        if not isfile(file_path):
+            count('dvh_cache.miss')
+            return None
+        try:
+            with np.load(file_path) as data:
+                counts, bin_width, name = data['counts'], float(data['bin_width']), str(data['name'])
+        except (OSError, KeyError, ValueError):  # e.g., partially written by another process
+            count('dvh_cache.miss')
+            return None
+        count('dvh_cache.hit')
+        # divide by bins per Gy rather than multiply by bin width to reproduce dvhcalc's bins exactly
+        bins = np.arange(counts.size + 1) / round(1. / bin_width, 6)
+        return DVH(counts, bins, dvh_type='cumulative', dose_units='Gy', name=name)
+
+    def set(self, rtstruct_uid, rtdose_uid, roi_key, dvh):
+        # written to a temp file unique to this call then renamed, so concurrent writers of the same DVH (threads or
+        # processes) never share a partial file.  The DVH has already been calculated, so a failed write is only
+        # logged.
+        file_path = self.get_file_path(rtstruct_uid, rtdose_uid, roi_key)
+        temp_path = None
+        try:
+            fd, temp_path = mkstemp(dir=self.cache_dir, suffix='.tmp.npz')
+            with fdopen(fd, 'wb') as document:
+                np.savez_compressed(document, counts=dvh.counts, bin_width=dvh.bins[1] - dvh.bins[0],
+                                    name=str(dvh.name))
+            replace(temp_path, file_path)
+        except OSError as e:
+            logger.warning('Could not cache the DVH of ROI %s in %s: %s', roi_key, self.cache_dir, e)
+            if temp_path is not None and isfile(temp_path):
+                remove(temp_path)
@@ -0,0 +1,105 @@
+import site
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_all_start_methods, get_context
+from os import cpu_count
+from os.path import abspath
+from threading import Lock
+from dicompylercore import dvhcalc
+from dicom_cache import DicomCache, MAX_CACHE_SIZE
+from dvh_cache import DVH_CALC_SETTINGS
+import dvh_stream
+from metrics import timed
+from paths import SCRIPT_DIR
+
+DVH_WORKERS = cpu_count() or 1  # processes used to calculate DVHs, 1 calculates them in the calling process
+STREAM_DVHS = True  # memory-map RT Dose pixel data, see dvh_stream.py, only used with the default calc settings
+MULTI_ROI_DVHS = True  # calculate_dvhs histograms several ROIs per pass over the dose grid, see dvh_stream.get_dvhs
+# workers aren't forked from the server process, which is running Bokeh's and the inbox watcher's threads
+WORKER_START_METHOD = 'forkserver' if 'forkserver' in get_all_start_methods() else 'spawn'
+WORKER_CACHE_SIZE = MAX_CACHE_SIZE // DVH_WORKERS  # the workers' DICOM caches split MAX_CACHE_SIZE
+
+_executor = None
+_executor_lock = Lock()
+_worker_cache = None
+
+
+def get_executor(workers=DVH_WORKERS):
+    # One pool per server process, shared by every session, replaced if a worker died.  Tasks are unpickled by
+    # module name, and bokeh serve only has this directory on sys.path while main.py runs, so each worker adds it
+    # before anything of this app is loaded (hence a stdlib initializer).
+    global _executor
+    with _executor_lock:
+        if _executor is None or _executor._broken:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context(WORKER_START_METHOD),
+                                            initializer=site.addsitedir, initargs=(abspath(SCRIPT_DIR),))
+        return _executor
+
+
+def get_dicom_cache(dicom_cache=None):
+    # Each worker process keeps its own DicomCache, so a plan's files are parsed once per worker
+    global _worker_cache
+    if dicom_cache is None:
+        if _worker_cache is None:
+            _worker_cache = DicomCache(max_size=WORKER_CACHE_SIZE)
+        dicom_cache = _worker_cache
+    return dicom_cache
+
+
+@timed('calculate_dvh')
+def calculate_dvh(rtstruct_file, rtdose_file, roi_key, settings=None, dicom_cache=None):
+    dicom_cache = get_dicom_cache(dicom_cache)
+    settings = DVH_CALC_SETTINGS if settings is None else settings
+    rtss = dicom_cache.get_parser(rtstruct_file)
+    dvh = None
+    if STREAM_DVHS and not settings:
+        dvh = dvh_stream.get_dvh(rtss, rtdose_file, roi_key)
+    if dvh is None:  # compressed dose grid or non-default settings
+        dvh = dvhcalc.get_dvh(rtss.ds, dicom_cache.get_dataset(rtdose_file), roi_key, **settings)
+    return roi_key, dvh
+
+
+@timed('calculate_dvh_group')
+def calculate_dvh_group(rtstruct_file, rtdose_file, roi_keys, settings=None, dicom_cache=None):
+    # returns [(roi_key, dvh)], calculated in one pass over the dose grid when possible
+    dicom_cache = get_dicom_cache(dicom_cache)
+    settings = DVH_CALC_SETTINGS if settings is None else settings
+    if STREAM_DVHS and not settings:
+        dvhs = dvh_stream.get_dvhs(dicom_cache.get_parser(rtstruct_file), rtdose_file, roi_keys)
+        if dvhs is not None:
+            return [(roi_key, dvhs[roi_key]) for roi_key in roi_keys]
+    return [calculate_dvh(rtstruct_file, rtdose_file, roi_key, settings=settings, dicom_cache=dicom_cache)
+            for roi_key in roi_keys]
+
+
+def calculate_dvhs(rtstruct_file, rtdose_file, roi_keys, settings=None, workers=DVH_WORKERS, dicom_cache=None,
+                   multi_roi=MULTI_ROI_DVHS):
+    # Yields (roi_key, dvh) as each DVH finishes, not necessarily in the order of roi_keys
+    # dicom_cache is only used when calculating in the calling process
+    # With multi_roi, the ROIs are split into one group per worker and each group shares a pass over the dose grid
+    if multi_roi:
+        groups = [roi_keys[i::workers] for i in range(min(workers, len(roi_keys)))]
+        if len(groups) <= 1:
+            for dvh in calculate_dvh_group(rtstruct_file, rtdose_file, roi_keys, settings=settings,
+                                           dicom_cache=dicom_cache):
+                yield dvh
+            return
+
+        executor = get_executor(workers)
+        futures = [executor.submit(calculate_dvh_group, rtstruct_file, rtdose_file, group, settings)
+                   for group in groups]
+        for future in as_completed(futures):
+            for dvh in future.result():
+                yield dvh
+        return
+
+    if workers <= 1 or len(roi_keys) <= 1:
+        for roi_key in roi_keys:
+            yield calculate_dvh(rtstruct_file, rtdose_file, roi_key, settings=settings, dicom_cache=dicom_cache)
+        return
+
+    executor = get_executor(workers)
+    futures = [executor.submit(calculate_dvh, rtstruct_file, rtdose_file, roi_key, settings) for roi_key in roi_keys]
+    for future in as_completed(futures):
+        yield future.result()
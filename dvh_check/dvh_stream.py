@@ -0,0 +1,173 @@
+import logging
+import struct
+from functools import lru_cache
+from os.path import getmtime
+import matplotlib.path
+import numpy as np
+import pydicom as dicom
+from dicompylercore import dicomparser
+from dicompylercore.dvh import DVH
+
+PIXEL_DATA_TAG = (0x7FE0, 0x0010)
+LONG_LENGTH_VRS = {b'OB', b'OD', b'OF', b'OL', b'OV', b'OW', b'SQ', b'UC', b'UN', b'UR', b'UT'}
+DOSE_GRID_CACHE_SIZE = 8  # RT Dose headers kept per process, the pixel data itself is never held in memory
+
+logger = logging.getLogger('dvh_check.dvh_stream')
+
+
+# Bounded memory DVH calculation.  This follows dvhcalc.get_dvh with its default settings and gives identical
+# results, but the RT Dose pixel data is memory-mapped rather than decoded, only the dose plane for the current
+# contour plane is read, and each plane's histogram is added to a single bin array per ROI as it's calculated.
+
+
+def get_pixel_data_offset(fp, ds):
+    # fp is positioned at the Pixel Data element after reading with stop_before_pixels, returns the file offset
+    # of its value, or None if it isn't there or is encapsulated (compressed), since that can't be memory-mapped
+    endian = '<' if ds.is_little_endian else '>'
+    header = fp.read(8)
+    if len(header) < 8 or struct.unpack(endian + 'HH', header[:4]) != PIXEL_DATA_TAG:
+        return None
+    if ds.is_implicit_VR:
+        length, offset = struct.unpack(endian + 'L', header[4:])[0], fp.tell()
+    elif header[4:6] in LONG_LENGTH_VRS:
+        length, offset = struct.unpack(endian + 'L', fp.read(4))[0], fp.tell()
+    else:
+        length, offset = struct.unpack(endian + 'H', header[6:])[0], fp.tell()
+    if length == 0xFFFFFFFF:
+        return None
+    return offset
+
+
+def get_dose_grid(file_path):
+    return _get_dose_grid(file_path, getmtime(file_path))
+
+
+@lru_cache(maxsize=DOSE_GRID_CACHE_SIZE)
+def _get_dose_grid(file_path, mtime):
+    # returns (DicomParser, dose data) with the parser's pixel array memory-mapped, None if that isn't possible
+    with open(file_path, 'rb') as fp:
+        ds = dicom.read_file(fp, stop_before_pixels=True, force=True)
+        offset = get_pixel_data_offset(fp, ds)
+    if offset is None or 'GridFrameOffsetVector' not in ds:
+        return None
+
+    # dicompyler's own memmap support assumes an 8 byte element header, so point it at the real offset.  These are
+    # DicomParser internals (tested with the dicompyler-core versions setup.py allows), if they've changed the
+    # caller falls back to dvhcalc.  Reading the first plane checks GetDoseGrid works from the memory map too.
+    try:
+        rtdose = dicomparser.DicomParser(ds)
+        rtdose.memmap_pixel_array = True
+        rtdose.filename, rtdose.offset = file_path, offset
+        rtdose.pixel_array = rtdose.GetPixelArray()
+        dose_data = rtdose.GetDoseData()  # dosemax is found one frame at a time
+        rtdose.GetDoseGrid(float(ds.ImagePositionPatient[2]))
+    except (AttributeError, TypeError) as e:
+        logger.warning('Could not memory-map %s, DVHs will be calculated with dvhcalc: %r', file_path, e)
+        return None
+    return rtdose, dose_data
+
+
+def get_dvh(rtss, rtdose_file, roi):
+    # rtss is a DicomParser of the structure set, returns a cumulative DVH or None if the dose can't be memory-mapped
+    dvhs = get_dvhs(rtss, rtdose_file, [roi])
+    return None if dvhs is None else dvhs[roi]
+
+
+def get_dvhs(rtss, rtdose_file, rois):
+    # One pass over the dose grid for every roi, returns {roi: cumulative DVH} or None if the dose can't be
+    # memory-mapped.  Each dose plane is read (or interpolated) and binned once, then every ROI contoured on that
+    # plane is histogrammed from it with a single bincount.
+    dose_grid = get_dose_grid(rtdose_file)
+    if dose_grid is None:
+        return None
+    rtdose, dd = dose_grid
+    image_data = rtdose.GetImageData()
+
+    structures = rtss.GetStructures()
+    plane_rois = {}  # {z: [roi, ...]}, dvhcalc sorts the z strings rather than their values, so do the same
+    for roi in rois:
+        structure = structures[roi]
+        structure['planes'] = rtss.GetStructureCoordinates(roi)
+        structure['thickness'] = rtss.CalculatePlaneThickness(structure['planes'])
+        for z in structure['planes']:
+            plane_rois.setdefault(z, []).append(roi)
+
+    x, y = np.meshgrid(np.array(dd['lut'][dd['x_lut_index']]), np.array(dd['lut'][1 - dd['x_lut_index']]))
+    dose_grid_points = np.vstack((x.flatten(), y.flatten())).T
+    max_dose = int(dd['dosemax'] * dd['dosegridscaling'] * 100) + 1
+    pixel_area = abs(np.mean(np.diff(dd['lut'][0]))) * abs(np.mean(np.diff(dd['lut'][1])))
+
+    hists = {roi: np.zeros(max_dose, dtype=np.int64) for roi in rois}
+    volumes = {roi: 0 for roi in rois}
+    notes = {roi: None for roi in rois}
+    for z in sorted(plane_rois):
+        dose_plane = rtdose.GetDoseGrid(z)
+        volume_only = not dose_plane.size
+        if volume_only:
+            # as dvhcalc does with calculate_full_volume
+            dose_plane = rtdose.GetDoseGrid(image_data['position'][2])
+        dose_bins, in_range = get_dose_bins(dose_plane * dd['dosegridscaling'] * 100, max_dose)
+
+        indices = []
+        for i, roi in enumerate(plane_rois[z]):
+            structure = structures[roi]
+            voxels = dose_bins[get_plane_mask(structure['planes'][z], dd, dose_grid_points) & in_range]
+            volumes[roi] += voxels.size * (pixel_area * structure['thickness'])
+            if volume_only:
+                notes[roi] = 'Dose grid does not encompass every contour. Volume calculated for all contours.'
+            else:
+                indices.append(voxels + i * max_dose)
+
+        if indices:
+            counts = np.bincount(np.concatenate(indices), minlength=len(plane_rois[z]) * max_dose)
+            for i, roi in enumerate(plane_rois[z]):
+                hists[roi] += counts[i * max_dose:(i + 1) * max_dose]
+
+    dvhs = {}
+    for roi in rois:
+        hist, name = hists[roi], structures[roi]['name']
+        if hist.max() <= 0:
+            dvhs[roi] = get_empty_dvh(name)
+            continue
+        counts = np.trim_zeros(hist * (volumes[roi] / 1000) / hist.sum(), trim='b')
+        bins = np.arange(0, 2) if counts.size == 1 else np.arange(0, counts.size + 1) / 100
+        dvhs[roi] = DVH(counts=counts, bins=bins, dvh_type='differential', dose_units='Gy', notes=notes[roi],
+                        name=name).cumulative
+    return dvhs
+
+
+def get_dose_bins(dose_plane, max_dose):
+    # 1 cGy bin index of each voxel and whether it's in the histogram, the same as np.histogram(dose, bins=max_dose,
+    # range=(0, max_dose)) since its bin edges are whole numbers, so a dose of exactly max_dose is in the last bin
+    in_range = (dose_plane >= 0) & (dose_plane <= max_dose)
+    dose_bins = np.minimum(np.where(in_range, dose_plane, 0).astype(np.intp), max_dose - 1)
+    return dose_bins, in_range
+
+
+def get_plane_mask(plane, dd, dose_grid_points):
+    # dvhcalc.calculate_plane_histogram's mask, xor of each contour's mask to remove holes
+    mask = None
+    for contour in plane:
+        contour_mask = get_contour_mask(dd, dose_grid_points, [point[0:2] for point in contour['data']])
+        mask = contour_mask if mask is None else np.logical_xor(mask, contour_mask)
+    return mask
+
+
+def get_contour_mask(dd, dose_grid_points, contour):
+    # dvhcalc.get_contour_mask, but only points within the contour's bounding box are tested since nothing outside
+    # it can be inside the contour
+    lower, upper = np.min(contour, axis=0), np.max(contour, axis=0)
+    candidates = np.flatnonzero(np.all((dose_grid_points >= lower) & (dose_grid_points <= upper), axis=1))
+    mask = np.zeros(len(dose_grid_points), dtype=bool)
+    if candidates.size:
+        mask[candidates] = matplotlib.path.Path(list(contour)).contains_points(dose_grid_points[candidates])
+
+    lut = dd['lut']
+    if dd['x_lut_index'] == 0:  # X values across columns
+        return mask.reshape((len(lut[1]), len(lut[0])))
+    return mask.reshape((len(lut[0]), len(lut[1]))).T  # decubitus
+
+
+def get_empty_dvh(name):
+    return DVH(counts=np.array([0]), bins=np.arange(0, 2), dvh_type='differential', dose_units='Gy',
+               notes='Empty DVH', name=name).cumulative
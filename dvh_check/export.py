@@ -0,0 +1,101 @@
+import json
+import numpy as np
+from os import makedirs, getpid, replace
+from os.path import join, isfile
+from threading import Lock
+from time import time
+from dicompylercore.dvh import DVH
+
+EXPORT_VERSION = 1
+MANIFEST_FILE = 'manifest.jsonl'
+COLUMNS = ['plan', 'plan_uid', 'protocol', 'fractionation', 'roi_template', 'roi_name', 'roi_key', 'volume',
+           'min_dose', 'mean_dose', 'max_dose', 'constraint', 'constraint_calc', 'pass_fail', 'error']
+FLOAT_COLUMNS = {'volume', 'min_dose', 'mean_dose', 'max_dose', 'constraint_calc'}  # missing values are NaN
+DVH_COLUMNS = ['dvh_plan_uid', 'dvh_roi_key', 'dvh_roi_name', 'dvh_bin_width', 'dvh_offsets', 'dvh_counts']
+
+
+# Append-only export of scorecard rows and cumulative DVHs for analysis outside the app.  Each append writes one
+# compressed .npz part with a column per scorecard field (strings as unicode arrays, so no pickles) and the DVHs
+# of that append as one float32 array of counts (cm3) with offsets.  manifest.jsonl gets one line per part listing
+# its plans and protocols, so readers only open the parts they need and never see a partially written part.
+class ResultsExport:
+    def __init__(self, export_dir):
+        self.export_dir = export_dir
+        self.manifest_file = join(export_dir, MANIFEST_FILE)
+        self.lock = Lock()
+        makedirs(export_dir, exist_ok=True)
+
+    @property
+    def parts(self):
+        if not isfile(self.manifest_file):
+            return []
+        with open(self.manifest_file, 'r') as document:
+            return [json.loads(line) for line in document if line.strip()]
+
+    def append(self, rows, dvhs=None):
+        # rows: list of dicts keyed by COLUMNS, dvhs: list of (plan_uid, roi_key, DVH)
+        dvhs = dvhs or []
+        data = {column: get_column(rows, column) for column in COLUMNS}
+        counts = [np.asarray(dvh.counts, dtype=np.float32) for plan_uid, roi_key, dvh in dvhs]
+        data.update({'dvh_plan_uid': np.array([str(d[0]) for d in dvhs], dtype=str),
+                     'dvh_roi_key': np.array([str(d[1]) for d in dvhs], dtype=str),
+                     'dvh_roi_name': np.array([str(d[2].name) for d in dvhs], dtype=str),
+                     'dvh_bin_width': np.array([d[2].bins[1] - d[2].bins[0] for d in dvhs], dtype=np.float64),
+                     'dvh_offsets': np.cumsum([0] + [c.size for c in counts], dtype=np.int64),
+                     'dvh_counts': np.concatenate(counts) if counts else np.zeros(0, dtype=np.float32)})
+
+        with self.lock:
+            created = time()
+            file_name = 'part-%d-%d.npz' % (created * 1e6, getpid())
+            temp_path = join(self.export_dir, file_name.replace('.npz', '.tmp.npz'))
+            np.savez_compressed(temp_path, **data)
+            replace(temp_path, join(self.export_dir, file_name))
+            part = {'file': file_name, 'version': EXPORT_VERSION, 'created': created, 'rows': len(rows),
+                    'dvhs': len(dvhs), 'plan_uids': sorted(set(data['plan_uid']) | set(data['dvh_plan_uid'])),
+                    'protocols': sorted(set(data['protocol']))}
+            with open(self.manifest_file, 'a') as document:  # a single write, so appends don't interleave
+                document.write(json.dumps(part) + '\n')
+        return part
+
+    def get_parts(self, plan_uids=None, protocols=None):
+        parts = self.parts
+        if plan_uids is not None:
+            parts = [part for part in parts if set(part['plan_uids']).intersection(plan_uids)]
+        if protocols is not None:
+            parts = [part for part in parts if set(part['protocols']).intersection(protocols)]
+        return parts
+
+    def read_rows(self, columns=None, plan_uids=None, protocols=None):
+        # returns {column: array} of every exported row in the matching parts, only the columns asked for are read
+        columns = COLUMNS if columns is None else columns
+        data = {column: [] for column in columns}
+        for part in self.get_parts(plan_uids=plan_uids, protocols=protocols):
+            with np.load(join(self.export_dir, part['file'])) as part_data:
+                for column in columns:
+                    data[column].append(part_data[column])
+        return {column: np.concatenate(arrays) if arrays else get_column([], column)
+                for column, arrays in data.items()}
+
+    def iter_dvhs(self, plan_uids=None):
+        # yields (plan_uid, roi_key, DVH), roi_key as a string
+        for part in self.get_parts(plan_uids=plan_uids):
+            if not part['dvhs']:
+                continue
+            with np.load(join(self.export_dir, part['file'])) as part_data:
+                data = {column: part_data[column] for column in DVH_COLUMNS}
+            offsets = data['dvh_offsets']
+            for i, plan_uid in enumerate(data['dvh_plan_uid']):
+                if plan_uids is not None and plan_uid not in plan_uids:
+                    continue
+                counts = data['dvh_counts'][offsets[i]:offsets[i + 1]].astype(np.float64)
+                # bins are rebuilt the same way as DVHCache.get
+                bins = np.arange(counts.size + 1) / round(1. / data['dvh_bin_width'][i], 6)
+                yield str(plan_uid), str(data['dvh_roi_key'][i]), \
+                    DVH(counts, bins, dvh_type='cumulative', dose_units='Gy', name=str(data['dvh_roi_name'][i]))
+
+
+def get_column(rows, column):
+    values = [row.get(column) for row in rows]
+    if column in FLOAT_COLUMNS:
+        return np.array([np.nan if value in {None, ''} else float(value) for value in values], dtype=np.float64)
+    return np.array(['' if value is None else str(value) for value in values], dtype=str)
@@ -0,0 +1,65 @@
+import logging
+from os import stat
+from threading import Thread, Event
+from utilities import get_file_paths, get_dicom_tag_values
+from dicom_index import DicomIndex
+
+POLL_INTERVAL = 5.  # seconds between inbox polls
+
+logger = logging.getLogger('dvh_check.inbox_watcher')
+
+
+# Polls a directory for new, changed, or removed files using only stat calls, headers are read only for files
+# that changed.  callback(tag_values, removed_files) is called from this thread, so it should hand the results off
+# to the Bokeh document with add_next_tick_callback rather than touch models directly.
+class InboxWatcher(Thread):
+    def __init__(self, start_path, callback, file_stats=None, index_file=None, interval=POLL_INTERVAL,
+                 search_subfolders=True):
+        Thread.__init__(self, daemon=True)
+        self.start_path = start_path
+        self.callback = callback
+        self.file_stats = dict(file_stats) if file_stats else {}
+        self.index_file = index_file
+        self.interval = interval
+        self.search_subfolders = search_subfolders
+        self.stop_event = Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:  # e.g., the inbox is unavailable or the callback failed, keep watching
+                logger.exception('Polling %s failed', self.start_path)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def poll(self):
+        file_stats = {}
+        for file_path in get_file_paths(self.start_path, search_subfolders=self.search_subfolders):
+            try:
+                file_stat = stat(file_path)
+            except OSError:  # removed since the directory was listed
+                continue
+            file_stats[file_path] = (file_stat.st_size, file_stat.st_mtime)
+
+        changed_files = [f for f, file_stat in file_stats.items() if self.file_stats.get(f) != file_stat]
+        removed_files = [f for f in self.file_stats if f not in file_stats]
+
+        tag_values = {}
+        for file_path in changed_files:
+            try:
+                tag_values[file_path] = get_dicom_tag_values(file_path, timestamp=file_stats[file_path][1])
+            except Exception:  # likely still being written, try again on the next poll
+                file_stats.pop(file_path)
+
+        if tag_values or removed_files:
+            if self.index_file:
+                index = DicomIndex(self.index_file)
+                for file_path, values in tag_values.items():
+                    index.update(file_path, file_stats[file_path][0], file_stats[file_path][1], values)
+                index.remove(removed_files)
+                index.commit()
+                index.close()
+            self.callback(tag_values, removed_files)
+        self.file_stats = file_stats  # only once handled, so changes are found again if the callback failed
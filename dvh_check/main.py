@@ -2,7 +2,7 @@ from bokeh.io import curdoc
 from view import ScoreCardView
 
 
-view = ScoreCardView()
+view = ScoreCardView(curdoc())
 
 curdoc().add_root(view.layout)
 curdoc().title = 'University of Chicago Radiation Oncology - DICOM Score Card'
@@ -0,0 +1,89 @@
+import sqlite3
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from metrics import count
+
+MAX_MATCH_CACHE_SIZE = 10000  # entries, the least recently used are evicted first
+SQLITE_MAX_VARIABLES = 500
+
+
+# Persistent cache of the best alias match for each cleaned plan ROI name, shared by sessions and batch workers.
+# Entries are keyed by (cleaned name, alias table version), so any change to the aliases misses the old entries,
+# which then age out.  Recently used entries are also kept in memory.
+class MatchCache:
+    def __init__(self, cache_file, max_size=MAX_MATCH_CACHE_SIZE):
+        self.cache_file = cache_file
+        self.max_size = max_size
+        self.lock = Lock()
+        self.memory = OrderedDict()  # {(cleaned name, version): (match, score)}
+        self.connection = sqlite3.connect(cache_file, timeout=10., check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS roi_matches (name TEXT, version TEXT, match TEXT, '
+                                'score REAL, last_used REAL, PRIMARY KEY (name, version))')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS roi_matches_last_used ON roi_matches (last_used)')
+        self.connection.commit()
+
+    def get(self, names, version):
+        # returns {cleaned name: (match, score)} for the names found in the cache
+        matches, missing = {}, []
+        with self.lock:
+            for name in names:
+                if (name, version) in self.memory:
+                    self.memory.move_to_end((name, version))
+                    matches[name] = self.memory[(name, version)]
+                else:
+                    missing.append(name)
+
+            try:
+                for i in range(0, len(missing), SQLITE_MAX_VARIABLES):
+                    chunk = missing[i:i + SQLITE_MAX_VARIABLES]
+                    query = 'SELECT name, match, score FROM roi_matches WHERE version = ? AND name IN (%s)' % \
+                            ', '.join(['?'] * len(chunk))
+                    for name, match, score in self.connection.execute(query, [version] + chunk).fetchall():
+                        matches[name] = (match, score)
+                        self.__remember(name, version, (match, score))
+                found = [name for name in missing if name in matches]
+                if found:
+                    self.connection.executemany('UPDATE roi_matches SET last_used = ? WHERE name = ? AND version = ?',
+                                                [(time(), name, version) for name in found])
+                    self.connection.commit()
+            except sqlite3.Error:  # e.g., locked by another process, just recalculate
+                pass
+
+        count('match_cache.hit', len(matches))
+        count('match_cache.miss', len(names) - len(matches))
+        return matches
+
+    def set(self, matches, version):
+        # matches is {cleaned name: (match, score)}
+        with self.lock:
+            for name, match in matches.items():
+                self.__remember(name, version, match)
+            try:
+                now = time()
+                self.connection.executemany('INSERT OR REPLACE INTO roi_matches VALUES (?, ?, ?, ?, ?)',
+                                            [(name, version, match, score, now)
+                                             for name, (match, score) in matches.items()])
+                row_count = self.connection.execute('SELECT COUNT(*) FROM roi_matches').fetchone()[0]
+                if row_count > self.max_size:
+                    self.connection.execute('DELETE FROM roi_matches WHERE rowid IN (SELECT rowid FROM roi_matches '
+                                            'ORDER BY last_used LIMIT ?)', (row_count - self.max_size,))
+                self.connection.commit()
+            except sqlite3.Error:
+                self.connection.rollback()
+
+    def __remember(self, name, version, match):
+        self.memory[(name, version)] = match
+        self.memory.move_to_end((name, version))
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.connection.execute('DELETE FROM roi_matches')
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
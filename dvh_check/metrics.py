@@ -0,0 +1,81 @@
+import logging
+from functools import wraps
+from os import environ
+from threading import Lock
+from time import perf_counter
+
+# Set DVH_CHECK_METRICS=1 before starting the server (or batch) to time the hot paths and count cache hits.
+# When it's off, timed returns functions unwrapped and count returns immediately.
+METRICS_ENABLED = environ.get('DVH_CHECK_METRICS', '').lower() not in {'', '0', 'false', 'no'}
+
+logger = logging.getLogger('dvh_check.metrics')
+
+
+# Process-wide stage timings and counters, the Bokeh view shows them in its diagnostics panel.  Calculations run
+# in worker processes (see dvh_engine.DVH_WORKERS) are only counted in those processes.
+class Metrics:
+    def __init__(self):
+        self.lock = Lock()
+        self.stages = {}  # {stage: [calls, total seconds, max seconds]}
+        self.counters = {}  # {name: count}
+
+    def record(self, stage, seconds):
+        with self.lock:
+            stats = self.stages.setdefault(stage, [0, 0., 0.])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+        logger.debug('%s took %.1f ms', stage, 1e3 * seconds)
+
+    def increment(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def get_snapshot(self):
+        with self.lock:
+            return {'stages': {stage: {'calls': calls, 'total': total, 'mean': total / calls, 'max': max_seconds}
+                               for stage, (calls, total, max_seconds) in self.stages.items()},
+                    'counters': dict(self.counters)}
+
+    def reset(self):
+        with self.lock:
+            self.stages.clear()
+            self.counters.clear()
+
+    def log(self, level=logging.INFO):
+        snapshot = self.get_snapshot()
+        for stage, stats in sorted(snapshot['stages'].items()):
+            logger.log(level, '%s: %d calls, %.1f ms total, %.1f ms mean, %.1f ms max', stage, stats['calls'],
+                       1e3 * stats['total'], 1e3 * stats['mean'], 1e3 * stats['max'])
+        for name, value in sorted(snapshot['counters'].items()):
+            logger.log(level, '%s: %d', name, value)
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    return _metrics
+
+
+def timed(stage):
+    # decorator recording the wall time of each call as stage
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _metrics.record(stage, perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    # e.g., count('dvh_cache.hit')
+    if METRICS_ENABLED:
+        _metrics.increment(name, n)
@@ -0,0 +1,58 @@
+PATCH_ROWS = 50  # rows collected before patching without waiting for the next tick
+
+
+# Collects ColumnDataSource patches and sends them as one patch per tick (or per PATCH_ROWS rows) rather than one
+# websocket message per call.  Must be used from the document's thread, like the source itself.  Pending values are
+# not in source.data yet, so code reading patched cells should use get.  Without a document, every patch is sent
+# immediately.
+class PatchAggregator:
+    def __init__(self, source, doc=None, max_rows=PATCH_ROWS):
+        self.source = source
+        self.doc = doc
+        self.max_rows = max_rows
+        self.pending = {}  # {column: {index: value}}
+        self.rows = set()
+        self.flush_scheduled = False
+
+    def patch(self, patches):
+        # patches is {column: [(index, value)]}, as for ColumnDataSource.patch, later values replace earlier ones
+        for column, changes in patches.items():
+            pending = self.pending.setdefault(column, {})
+            for index, value in changes:
+                pending[index] = value
+                self.rows.add(index)
+
+        if self.doc is None or len(self.rows) >= self.max_rows:
+            self.flush()
+        elif not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.doc.add_next_tick_callback(self.flush_next_tick)
+
+    def flush_next_tick(self):
+        self.flush_scheduled = False
+        self.flush()
+
+    def flush(self):
+        # rows beyond the end of the source (removed since they were patched) are dropped, pending patches are only
+        # cleared once the source accepts them
+        if self.pending:
+            patches = {}
+            for column, changes in self.pending.items():
+                length = len(self.source.data[column])
+                changes = sorted((index, value) for index, value in changes.items() if index < length)
+                if changes:
+                    patches[column] = changes
+            if patches:
+                self.source.patch(patches)
+            self.clear()
+
+    def clear(self):
+        # drop pending patches, e.g., when source.data is replaced
+        self.pending = {}
+        self.rows = set()
+
+    def get(self, column, index):
+        pending = self.pending.get(column)
+        if pending and index in pending:
+            return pending[index]
+        return self.source.data[column][index]
@@ -4,3 +4,7 @@ SCRIPT_DIR = dirname(__file__)
 PROTOCOL_DIR = join(SCRIPT_DIR, 'protocols')
 INBOX_DIR = join(SCRIPT_DIR, 'test_files')
 ALIASES_FILE = join(SCRIPT_DIR, 'aliases.csv')
+INDEX_FILE = join(SCRIPT_DIR, 'dicom_index.db')
+DVH_CACHE_DIR = join(SCRIPT_DIR, 'dvh_cache')
+MATCH_CACHE_FILE = join(SCRIPT_DIR, 'roi_match_cache.db')
+EXPORT_DIR = join(SCRIPT_DIR, 'exports')
@@ -0,0 +1,53 @@
+# DVH curves for the Bokeh plot, nothing in here may import Bokeh
+import numpy as np
+
+PLOT_POINTS = 300  # points per DVH curve sent to the browser
+BINS_PER_GY = 100  # dvhcalc.get_dvh uses 1 cGy bins
+
+
+def get_lttb_indices(x, y, threshold=PLOT_POINTS):
+    # Largest-Triangle-Three-Buckets downsampling, returns the indices of the points to keep, including the first
+    # and the last point, picking from each bucket the point with the largest triangle against the point kept
+    # from the previous bucket and the average of the next bucket
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    bounds = (np.arange(threshold - 1) * every).astype(int) + 1
+    bounds[-1] = n - 1
+
+    # average of each bucket, the last point is the bucket after the last one
+    lengths = np.diff(np.append(bounds, n))
+    avg_x = np.add.reduceat(x, bounds) / lengths
+    avg_y = np.add.reduceat(y, bounds) / lengths
+
+    indices = np.zeros(threshold, dtype=np.intp)
+    indices[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = bounds[i], bounds[i + 1]
+        area = np.abs((x[a] - avg_x[i + 1]) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y[i + 1] - y[a]))
+        a = start + int(area.argmax())
+        indices[i + 1] = a
+    return indices
+
+
+def get_dvh_curves(dvh_counts, points=PLOT_POINTS):
+    # returns xs, ys: lists of float32 arrays of dose (Gy) and normalized volume for each cumulative DVH,
+    # downsampled to at most points each.  Bokeh sends float32 arrays as binary buffers rather than JSON lists.
+    if not dvh_counts:
+        return [], []
+    dose_axis = np.arange(max([len(counts) for counts in dvh_counts])) / BINS_PER_GY  # shared by every curve
+
+    xs, ys = [], []
+    for counts in dvh_counts:
+        if counts[0]:
+            y = np.divide(counts, counts[0])
+        else:
+            y = np.zeros(len(dose_axis))
+        x = dose_axis[:len(y)]
+        indices = get_lttb_indices(x, y, points)
+        xs.append(x[indices].astype(np.float32))
+        ys.append(y[indices].astype(np.float32))
+    return xs, ys
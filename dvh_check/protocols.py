@@ -1,159 +1,191 @@
 from os import listdir
-from os.path import isfile, join, basename
+from os.path import isfile, join, basename, getmtime
+from threading import Lock, RLock
 from paths import PROTOCOL_DIR
 
 MAX_DOSE_VOLUME = 0.03
 
+COLUMN_KEYS = ['string_rep', 'operator', 'input_value', 'input_units', 'input_type', 'output_units', 'output_type',
+               'input_scale', 'output_scale', 'threshold_value', 'calc_type']
 
+
+# Process-wide protocol library shared by every session.  The directory listing is refreshed only when the
+# directory's mtime changes, and a protocol file is parsed on first use and again only if its mtime changes.
+class ProtocolRegistry:
+    def __init__(self, protocol_dir=PROTOCOL_DIR):
+        self.protocol_dir = protocol_dir
+        self.lock = RLock()
+        self.dir_mtime = None
+        self.files = {}  # {protocol_name: {fractionation: file_path}}
+        self.parsed = {}  # {file_path: (mtime, constraints)}
+        self.column_data = {}  # {(protocol_name, fractionation): (mtime, compiled column data)}
+
+    @property
+    def file_names(self):
+        return [join(self.protocol_dir, f) for f in listdir(self.protocol_dir)
+                if isfile(join(self.protocol_dir, f)) and '.scp' in f]
+
+    def get_protocol_files(self):
+        with self.lock:
+            mtime = getmtime(self.protocol_dir)
+            if mtime != self.dir_mtime:
+                files = {}
+                for f in self.file_names:
+                    file_name = str(basename(f))
+                    name = file_name.split('_')[0]
+                    fxs = file_name.split('_')[1].replace('.scp', '')
+                    files.setdefault(name, {})[fxs] = f
+                self.files, self.dir_mtime = files, mtime
+            return self.files
+
+    def get_protocol_data(self, protocol_name, fractionation):
+        # returns (mtime, {roi_name: {constraint_label: threshold}})
+        file_path = self.get_protocol_files()[protocol_name][fractionation]
+        mtime = getmtime(file_path)
+        with self.lock:
+            if file_path not in self.parsed or self.parsed[file_path][0] != mtime:
+                self.parsed[file_path] = (mtime, parse_protocol_file(file_path))
+            return self.parsed[file_path]
+
+    def get_column_data(self, protocol_name, fractionation):
+        mtime, data = self.get_protocol_data(protocol_name, fractionation)
+        key = (protocol_name, fractionation)
+        with self.lock:
+            if key not in self.column_data or self.column_data[key][0] != mtime:
+                self.column_data[key] = (mtime, compile_column_data(data))
+            return self.column_data[key][1]
+
+
+_registry = None
+_registry_lock = Lock()
+
+
+def get_protocol_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ProtocolRegistry()
+        return _registry
+
+
+def parse_protocol_file(file_path):
+    constraints = {}
+    current_key = None
+    with open(file_path, 'r') as document:
+        for line in document:
+            if not(line.startswith('#') or line.strip() == ''):  # Skip line if empty or starts with #
+                if line[0] not in {'\t', ' '}:  # Constraint
+                    current_key = line.strip()
+                    constraints[current_key] = {}
+                else:  # OAR Name
+                    line_data = line.split()
+                    constraints[current_key][line_data[0]] = line_data[1]
+    return constraints
+
+
+def compile_column_data(protocol_data):
+    roi_template = []
+    data = {key: [] for key in COLUMN_KEYS}
+
+    for roi in sorted(protocol_data):
+        roi_type = ['OAR', 'PTV']['PTV' in roi]
+        for constraint_label, threshold in protocol_data[roi].items():
+            roi_template.append(roi)
+            constraint = Constraint(constraint_label, threshold, roi_type=roi_type)
+            for key, column in data.items():
+                column.append(getattr(constraint, key))
+    data['roi_template'] = roi_template
+
+    return {key: tuple(column) for key, column in data.items()}
+
+
+# Lightweight per-session view onto the shared ProtocolRegistry
 class Protocols:
-    def __init__(self):
-        self.__load()
-
-    def __load(self):
-        self.data = {}
-        for f in self.file_names:
-            file_name = str(basename(f))
-            name = file_name.split('_')[0]
-            fxs = file_name.split('_')[1].replace('.scp', '')
-            if name not in list(self.data):
-                self.data[name] = {}
-            self.data[name][fxs] = self.parse_protocol_file(f)
+    def __init__(self, registry=None):
+        self.registry = registry if registry is not None else get_protocol_registry()
 
     @property
     def file_names(self):
-        return [join(PROTOCOL_DIR, f) for f in listdir(PROTOCOL_DIR) if isfile(join(PROTOCOL_DIR, f)) and '.scp' in f]
-
-    @staticmethod
-    def parse_protocol_file(file_path):
-        constraints = {}
-        current_key = None
-        with open(file_path, 'r') as document:
-            for line in document:
-                if not(line.startswith('#') or line.strip() == ''):  # Skip line if empty or starts with #
-                    if line[0] not in {'\t', ' '}:  # Constraint
-                        current_key = line.strip()
-                        constraints[current_key] = {}
-                    else:  # OAR Name
-                        line_data = line.split()
-                        constraints[current_key][line_data[0]] = line_data[1]
-        return constraints
+        return self.registry.file_names
 
     @property
     def protocol_names(self):
-        protocols = list(self.data)
+        protocols = list(self.registry.get_protocol_files())
         protocols.sort()
         return protocols
 
     def get_fractionations(self, protocol_name):
-        fractionations = list(self.data[protocol_name])
+        fractionations = list(self.registry.get_protocol_files()[protocol_name])
         fractionations.sort()
         fractionations = [fx.replace('Fx', '') for fx in fractionations]
         return fractionations
 
     def get_rois(self, protocol_name, fractionation):
-        rois = list(self.data[protocol_name][fractionation])
+        rois = list(self.registry.get_protocol_data(protocol_name, fractionation)[1])
         rois.sort()
         return rois
 
     def get_constraints(self, protocol_name, fractionation, roi_name):
-        return self.data[protocol_name][fractionation][roi_name]
+        return self.registry.get_protocol_data(protocol_name, fractionation)[1][roi_name]
 
     def get_column_data(self, protocol_name, fractionation):
-        roi_template = []
-        keys = ['string_rep', 'operator', 'input_value', 'input_units', 'input_type', 'output_units', 'output_type',
-                'input_scale', 'output_scale', 'threshold_value', 'calc_type']
-        data = {key: [] for key in keys}
-
-        for roi in self.get_rois(protocol_name, fractionation):
-            roi_type = ['OAR', 'PTV']['PTV' in roi]
-            for constraint_label, threshold in self.get_constraints(protocol_name, fractionation, roi).items():
-                roi_template.append(roi)
-                constraint = Constraint(constraint_label, threshold, roi_type=roi_type)
-                for key, column in data.items():
-                    column.append(getattr(constraint, key))
-        data['roi_template'] = roi_template
-
-        return data
+        # callers (e.g., the Bokeh table) may modify the lists, so only hand out copies
+        column_data = self.registry.get_column_data(protocol_name, fractionation)
+        return {column: list(values) for column, values in column_data.items()}
 
 
+# Every derived field is computed once when the constraint is created, get_column_data reads most of them
 class Constraint:
+    __slots__ = ('constraint_label', 'threshold', 'roi_type', 'output_type', 'input', 'input_type', 'calc_type',
+                 'input_value', 'input_scale', 'output_scale', 'input_units', 'output_units', 'operator',
+                 'threshold_value', 'string_rep')
+
     def __init__(self, constraint_label, threshold, roi_type='OAR'):
         self.constraint_label = constraint_label
         self.threshold = threshold
         self.roi_type = roi_type
 
-    def __str__(self):
-        return "%s %s %s" % (self.constraint_label, self.operator, self.threshold)
-
-    def __repr__(self):
-        return self.__str__()
-
-    @property
-    def threshold_value(self):
-        if '%' in self.threshold:
-            return float(self.threshold.replace('%', '')) / 100.
-        return float(self.threshold)
-
-    @property
-    def string_rep(self):
-        return self.__str__()
+        label_data = constraint_label.split('_')
+        if constraint_label == 'Mean':
+            self.output_type, self.input = 'D', None
+        else:
+            self.output_type, self.input = label_data[0], label_data[1]
+
+        self.input_type = ['Volume', 'Dose'][self.output_type in {'V', 'MVS'}]
+        self.output_units = ['Gy', 'cc'][self.output_type in {'V', 'MVS'}]
+        if 'MVS' in constraint_label:
+            self.calc_type = 'MVS'
+        elif 'Mean' in constraint_label:
+            self.calc_type = 'Mean'
+        else:
+            self.calc_type = self.input_type
 
-    @property
-    def operator(self):
+        if self.input is None:
+            self.input_value, self.input_scale, self.input_units = None, None, None
+        else:
+            if 'max' in self.input:
+                self.input_value = MAX_DOSE_VOLUME
+            else:
+                self.input_value = float(self.input.replace('%', '').replace('_', ''))
+            self.input_scale = ['absolute', 'relative']['%' in self.input]
+            abs_units = ['cc', 'Gy'][self.input_type == 'Dose']
+            self.input_units = ['%', abs_units][self.input_scale == 'absolute']
+
+        self.output_scale = ['absolute', 'relative']['%' in threshold]
         if self.output_type == 'MVS':
-            return ['<', '>']['OAR' in self.roi_type]
-        return ['>', '<']['OAR' in self.roi_type]
+            self.operator = ['<', '>']['OAR' in roi_type]
+        else:
+            self.operator = ['>', '<']['OAR' in roi_type]
 
-    @property
-    def output_type(self):
-        if self.constraint_label == 'Mean':
-            return 'D'
-        return self.constraint_label.split('_')[0]
-
-    @property
-    def output_units(self):
-        return ['Gy', 'cc'][self.output_type in {'V', 'MVS'}]
-
-    @property
-    def input(self):
-        if self.constraint_label == 'Mean':
-            return None
-        return self.constraint_label.split('_')[1]
-
-    @property
-    def input_type(self):
-        return ['Volume', 'Dose'][self.output_type in {'V', 'MVS'}]
-
-    @property
-    def calc_type(self):
-        if 'MVS' in self.constraint_label:
-            return 'MVS'
-        if 'Mean' in self.constraint_label:
-            return 'Mean'
-        return self.input_type
-
-    @property
-    def input_value(self):
-        if self.input is None:
-            return None
-        if 'max' in self.input:
-            return MAX_DOSE_VOLUME
-        return float(self.input.replace('%', '').replace('_', ''))
+        if '%' in threshold:
+            self.threshold_value = float(threshold.replace('%', '')) / 100.
+        else:
+            self.threshold_value = float(threshold)
 
-    @property
-    def input_scale(self):
-        if self.input is None:
-            return None
-        return ['absolute', 'relative']['%' in self.input]
+        self.string_rep = "%s %s %s" % (constraint_label, self.operator, threshold)
 
-    @property
-    def output_scale(self):
-        return ['absolute', 'relative']['%' in self.threshold]
+    def __str__(self):
+        return self.string_rep
 
-    @property
-    def input_units(self):
-        if self.input is None:
-            return None
-        scale = ['absolute', 'relative']['%' in self.input]
-        abs_units = ['cc', 'Gy'][self.input_type == 'Dose']
-        return ['%', abs_units][scale == 'absolute']
+    def __repr__(self):
+        return self.__str__()
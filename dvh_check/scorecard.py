@@ -0,0 +1,172 @@
+# Scorecard logic shared by the Bokeh view and the headless batch mode, nothing in here may import Bokeh
+import numpy as np
+from metrics import timed
+
+DEFAULT_BIN_WIDTH = 0.01  # Gy, dvhcalc.get_dvh uses 1 cGy bins
+
+
+def get_roi_keys(structures):
+    return [key for key in structures if structures[key]['type'].upper() != 'MARKER']
+
+
+@timed('match_rois')
+def match_rois(aliases, roi_templates, structures, roi_override=None):
+    # returns [(plan roi name, roi key)] for each template roi, ('', '') if there's no match
+    roi_keys = get_roi_keys(structures)
+    roi_names = [str(structures[key]['name']) for key in roi_keys]
+    roi_key_map = {name: roi_keys[i] for i, name in enumerate(roi_names)}
+    roi_override = roi_override or {}
+
+    matches = aliases.match_protocol_rois(roi_templates, roi_names)
+    matched_rows = []
+    for protocol_roi in roi_templates:
+        match = matches.get(protocol_roi) or ''
+        if protocol_roi in roi_override:
+            match = roi_override[protocol_roi]
+        matched_rows.append((match, roi_key_map[match] if match else ''))
+    return matched_rows
+
+
+def calculate_constraint(dvh, calc_type, input_value):
+    if calc_type == 'Volume':
+        ans = dvh.dose_constraint(input_value, volume_units='cm3')
+        return float(str(ans).split(' ')[0])
+    if calc_type == 'Dose':
+        ans = dvh.volume_constraint(input_value, dose_units='Gy')
+        return float(str(ans).split(' ')[0])
+    if calc_type == 'Mean':
+        return dvh.mean
+    if calc_type == 'MVS':
+        ans = dvh.volume_constraint(input_value, dose_units='Gy')
+        ans = float(str(ans).split(' ')[0])
+        return dvh.volume - ans
+
+    return None
+
+
+def get_pass_fail(constraint, operator, threshold):
+    if constraint is None:
+        return ''
+    if operator == '<':
+        status = constraint < threshold
+    else:
+        status = constraint > threshold
+    return ['Fail', 'Pass'][status]
+
+
+# Vectorized equivalents of the functions above, used to evaluate many constraints (or many plans) at once.
+# Cumulative DVHs are stacked end to end in one array of counts (cm3) with the number of bins of each, and each
+# constraint row points to its ROI with roi_index (-1 if the template ROI wasn't matched).  Only the DVHs that rows
+# point to are read, and dose and volume constraints are binary searches (searchsorted) since cumulative counts
+# never increase and dose bins always do.  Results match calculate_constraint and the DVH statistics of dicompyler-core.
+STATISTICS = ['volume', 'min_dose', 'mean_dose', 'max_dose']
+
+
+def get_dvh_stack(dvhs):
+    # returns (counts of every DVH end to end, lengths, bin_width)
+    lengths = np.array([dvh.counts.size for dvh in dvhs], dtype=int)
+    counts = np.concatenate([dvh.counts for dvh in dvhs]) if dvhs else np.zeros(0)
+    bin_width = DEFAULT_BIN_WIDTH
+    for dvh in dvhs:
+        if dvh.counts.size > 1:  # empty DVHs have a single 1 Gy bin, they evaluate to 0 with any bin width
+            bin_width = dvh.bins[1] - dvh.bins[0]
+    return counts, lengths, bin_width
+
+
+def get_bins(bin_count, bin_width):
+    # divide by bins per Gy rather than multiply by bin width to reproduce dvhcalc's bins exactly
+    return np.arange(bin_count + 1) / round(1. / bin_width, 6)
+
+
+def get_starts(lengths):
+    return np.cumsum(lengths) - lengths
+
+
+def get_dvh_statistics(dvh_stack, lengths, bin_width=DEFAULT_BIN_WIDTH, rois=None):
+    # returns {'volume', 'min_dose', 'mean_dose', 'max_dose'}, an array for each with a value per ROI in rois (every
+    # ROI by default), calculated as DVH.volume, min, mean and max are
+    rois = np.arange(lengths.size) if rois is None else np.asarray(rois, dtype=int)
+    statistics = {column: np.zeros(rois.size) for column in STATISTICS}
+    if not rois.size:
+        return statistics
+    starts = get_starts(lengths)
+    bins = get_bins(lengths[rois].max(), bin_width)
+    centers = 0.5 * (bins[1:] + bins[:-1])
+    for i, roi in enumerate(rois):
+        counts = dvh_stack[starts[roi]:starts[roi] + lengths[roi]]
+        differential = abs(np.diff(np.append(counts, 0)))
+        statistics['volume'][i] = differential.sum()
+        if counts.size > 1 and counts.max() != 0:
+            has_dose = np.flatnonzero(differential > 0)
+            statistics['min_dose'][i] = bins[1:][has_dose[0]]
+            statistics['mean_dose'][i] = (centers[:counts.size] * differential).sum() / differential.sum()
+            statistics['max_dose'][i] = bins[1:][has_dose[-1]]
+    return statistics
+
+
+def get_dose_to_volume(counts, reversed_counts, volume, bins):
+    # DVH.dose_constraint(volume, volume_units='cm3'): the first bin with the count nearest volume, either the first
+    # count at most volume or the count before it (the first of its repeats).  reversed_counts is counts[::-1], a
+    # copy since searchsorted needs ascending values.
+    if volume > counts[0]:  # more than the ROI's volume
+        return 0.
+    index = counts.size - reversed_counts.searchsorted(volume, side='right')
+    if index > 0 and (index == counts.size or abs(counts[index - 1] - volume) <= abs(counts[index] - volume)):
+        index = counts.size - reversed_counts.searchsorted(counts[index - 1], side='right')
+    return bins[index]
+
+
+def get_volume_at_dose(dvh_stack, starts, lengths, dose, bins):
+    # DVH.volume_constraint(dose, dose_units='Gy'): the count of the first bin edge nearest dose, 0 past the last bin
+    upper = np.minimum(np.searchsorted(bins, dose), lengths)
+    lower = np.maximum(upper - 1, 0)
+    index = np.where((upper > 0) & (np.abs(bins[lower] - dose) <= np.abs(bins[upper] - dose)), lower, upper)
+    return np.where(index < lengths, dvh_stack[starts + np.minimum(index, lengths - 1)], 0.)
+
+
+def format_value(value):
+    # as str(DVHValue) does before calculate_constraint parses it
+    return float(format(value, '0.2f'))
+
+
+def evaluate_constraints(column_data, dvh_stack, lengths, roi_index, bin_width=DEFAULT_BIN_WIDTH):
+    # column_data from Protocols.get_column_data, returns (constraint values, pass_fail), values are nan and
+    # pass_fail is '' for rows without a DVH
+    roi_index = np.asarray(roi_index, dtype=int)
+    values = np.full(roi_index.size, np.nan)
+    rows = np.flatnonzero(roi_index >= 0)
+    if rows.size:
+        rois = roi_index[rows]
+        starts, row_lengths = get_starts(lengths)[rois], lengths[rois]
+        bins = get_bins(row_lengths.max(), bin_width)
+        calc_type = np.array(column_data['calc_type'], dtype=object)[rows]
+        input_value = np.array([np.nan if column_data['input_value'][i] is None else column_data['input_value'][i]
+                                for i in rows], dtype=float)
+
+        reversed_counts = {}
+        for row in np.flatnonzero(calc_type == 'Volume'):
+            roi = rois[row]
+            counts = dvh_stack[starts[row]:starts[row] + row_lengths[row]]
+            if roi not in reversed_counts:
+                reversed_counts[roi] = counts[::-1].copy()
+            values[rows[row]] = format_value(get_dose_to_volume(counts, reversed_counts[roi], input_value[row], bins))
+
+        is_dose = (calc_type == 'Dose') | (calc_type == 'MVS')
+        volume = get_volume_at_dose(dvh_stack, starts[is_dose], row_lengths[is_dose], input_value[is_dose], bins)
+        values[rows[is_dose]] = [format_value(value) for value in volume]
+
+        is_statistic = (calc_type == 'Mean') | (calc_type == 'MVS')
+        if is_statistic.any():
+            statistic_rois, inverse = np.unique(rois[is_statistic], return_inverse=True)
+            statistics = get_dvh_statistics(dvh_stack, lengths, bin_width, statistic_rois)
+            is_mean, is_mvs = calc_type == 'Mean', calc_type == 'MVS'
+            values[rows[is_mean]] = statistics['mean_dose'][inverse[is_mean[is_statistic]]]
+            values[rows[is_mvs]] = statistics['volume'][inverse[is_mvs[is_statistic]]] - values[rows[is_mvs]]
+
+    operator = np.array(column_data['operator'])
+    threshold = np.array(column_data['threshold_value'], dtype=float)
+    with np.errstate(invalid='ignore'):
+        status = np.where(operator == '<', values < threshold, values > threshold)
+    pass_fail = np.where(np.isnan(values), '', np.where(status, 'Pass', 'Fail'))
+
+    return values, pass_fail
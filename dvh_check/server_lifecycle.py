@@ -0,0 +1,11 @@
+# Bokeh server lifecycle hooks, bokeh serve calls these once per server process for this directory app
+from services import get_services
+
+
+def on_server_loaded(server_context):
+    # the inbox is scanned and watched before the first session connects, sessions share the results
+    get_services().scan_inbox()
+
+
+def on_server_unloaded(server_context):
+    get_services().close()
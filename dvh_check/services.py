@@ -0,0 +1,112 @@
+from collections import OrderedDict
+from threading import Lock, RLock
+from protocols import Protocols
+from utilities import DicomDirectoryParser
+from inbox_watcher import InboxWatcher
+from paths import INBOX_DIR, INDEX_FILE, DVH_CACHE_DIR, MATCH_CACHE_FILE, EXPORT_DIR
+from structure_aliases import StructureAliases
+from dicom_cache import DicomCache
+from dvh_cache import DVHCache
+from match_cache import MatchCache
+from export import ResultsExport
+
+SCAN_WORKERS = 8  # threads used to read DICOM headers when scanning the inbox
+MAX_SHARED_PLANS = 32  # plans with DVHs kept in memory, the least recently used are dropped (the disk cache remains)
+
+
+# Process-wide state shared by every Bokeh session: one inbox scan and watcher, the protocol registry, the alias
+# index, the DICOM and DVH caches, the results export, and the DVHs calculated so far for each plan.  Sessions keep
+# their own widgets and selections and only hold references to these.  Inbox listeners are called from the watcher
+# thread, so they should hand off to their document with add_next_tick_callback.
+class SharedServices:
+    def __init__(self, inbox_dir=INBOX_DIR, index_file=INDEX_FILE, dvh_cache_dir=DVH_CACHE_DIR,
+                 match_cache_file=MATCH_CACHE_FILE, export_dir=EXPORT_DIR):
+        self.inbox_dir = inbox_dir
+        self.index_file = index_file
+        self.lock = RLock()
+        self.parser = None
+        self.inbox_watcher = None
+        self.listeners = set()
+        self.dvhs = OrderedDict()  # {(rtstruct uid, rtdose uid): {roi_key: DVH}}
+        self.protocols = Protocols()
+        self.aliases = StructureAliases(match_cache=MatchCache(match_cache_file))
+        self.dicom_cache = DicomCache()
+        self.dvh_cache = DVHCache(dvh_cache_dir)
+        self.results_export = ResultsExport(export_dir)
+
+    def scan_inbox(self):
+        # a full scan, files unchanged since they were indexed are not opened again
+        with self.lock:
+            self.parser = DicomDirectoryParser(self.inbox_dir, index_file=self.index_file, workers=SCAN_WORKERS)
+            self.stop_inbox_watcher()
+            self.inbox_watcher = InboxWatcher(self.inbox_dir, self.inbox_watcher_callback,
+                                              file_stats=self.parser.file_stats, index_file=self.index_file)
+            self.inbox_watcher.start()
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener()
+
+    def stop_inbox_watcher(self):
+        with self.lock:
+            if self.inbox_watcher is not None:
+                self.inbox_watcher.stop()
+                self.inbox_watcher = None
+
+    def inbox_watcher_callback(self, tag_values, removed_files):
+        # called from the watcher thread
+        with self.lock:
+            self.parser.update_files(tag_values, removed_files=removed_files)
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener()
+
+    def get_plans(self):
+        # returns (plans, plan_file_sets), the inbox is scanned on first use.  Both are rebuilt rather than modified
+        # when the inbox changes, so callers may keep them.
+        with self.lock:
+            if self.parser is None:
+                self.scan_inbox()
+            return self.parser.plans, self.parser.plan_file_sets
+
+    @property
+    def scanned(self):
+        return self.parser is not None
+
+    def add_listener(self, listener):
+        # listener() is called once the plans have changed
+        with self.lock:
+            self.listeners.add(listener)
+
+    def remove_listener(self, listener):
+        with self.lock:
+            self.listeners.discard(listener)
+
+    def get_plan_dvhs(self, rtstruct_uid, rtdose_uid):
+        # the same dict is returned to every session viewing the plan, DVHs are only added to it
+        key = (rtstruct_uid, rtdose_uid)
+        with self.lock:
+            if key not in self.dvhs:
+                self.dvhs[key] = {}
+                while len(self.dvhs) > MAX_SHARED_PLANS:
+                    self.dvhs.popitem(last=False)
+            self.dvhs.move_to_end(key)
+            return self.dvhs[key]
+
+    def close(self):
+        self.stop_inbox_watcher()
+        with self.lock:
+            self.listeners.clear()
+            if self.aliases.match_cache is not None:
+                self.aliases.match_cache.close()
+
+
+_services = None
+_services_lock = Lock()
+
+
+def get_services():
+    global _services
+    with _services_lock:
+        if _services is None:
+            _services = SharedServices()
+        return _services
@@ -1,14 +1,25 @@
+import hashlib
+from threading import Lock
 from paths import ALIASES_FILE
 from fuzzywuzzy import fuzz
+import numpy as np
+try:
+    from rapidfuzz import process, distance
+except ImportError:
+    process = None
 
 FUZZ_SCORE_THRESHOLD = 0.3
 WEIGHT_SIMPLE = 1.
 WEIGHT_PARTIAL = 0.6
+FUZZ_WORKERS = -1  # rapidfuzz threads for the ratio matrix, -1 uses every core
 
 
 class StructureAliases:
-    def __init__(self):
+    def __init__(self, match_cache=None):
         self.roi = {}
+        self.index = None
+        self.index_lock = Lock()  # sessions share one StructureAliases, see services.py
+        self.match_cache = match_cache  # optional MatchCache
         self.load()
 
     @property
@@ -27,9 +38,17 @@ class StructureAliases:
         rois = []
         for roi in list(self.roi):
             rois.append(roi)
-            rois = rois + self.get_aliases(roi)
+            rois.extend(self.get_aliases(roi))
         return rois
 
+    @property
+    def alias_index(self):
+        # rebuilt lazily after load, add_template_roi, or delete_template_roi
+        with self.index_lock:
+            if self.index is None:
+                self.index = AliasIndex(self.roi, match_cache=self.match_cache)
+            return self.index
+
     def has_aliases(self, template_roi):
         return bool(self.get_aliases(template_roi))
 
@@ -41,6 +60,7 @@ class StructureAliases:
                 template_roi = template_roi.strip()
                 self.roi[template_roi] = [alias.strip() for alias in data if alias.strip()]
                 self.roi[template_roi].sort()
+        self.index = None
 
     def save(self):
         data = '\n'.join(self.get_csv_lines())
@@ -58,33 +78,36 @@ class StructureAliases:
             if aliases is None:
                 aliases = []
             self.roi[template_roi] = aliases
+            self.index = None
 
     def delete_template_roi(self, template_roi):
         if template_roi in list(self.roi):
             self.roi.pop(template_roi)
+            self.index = None
 
     def get_best_roi_match(self, roi):
-        fuzz_scores = get_combined_fuzz_scores(roi, self.all_rois)
-        return fuzz_scores[0][1], fuzz_scores[0][0]
+        return self.alias_index.get_best_match(roi)
 
     def get_best_template_roi_match(self, roi):
-        best_match, best_score = self.get_best_roi_match(roi)
-        for template_roi in list(self.roi):
-            if template_roi == best_match:
-                return template_roi, roi, best_score
-            for alias in self.roi[template_roi]:
-                if alias == best_match:
-                    return template_roi, roi, best_score
-        return None, roi, 0.
+        return self.get_best_template_roi_matches([roi])[0]
+
+    def get_best_template_roi_matches(self, rois):
+        # scores every roi in one batch, returns [(template roi, roi, score)]
+        matches = []
+        for roi, (best_match, best_score) in zip(rois, self.alias_index.get_best_matches(rois)):
+            template_roi = self.alias_index.template_roi.get(best_match)
+            if template_roi is None:
+                matches.append((None, roi, 0.))
+            else:
+                matches.append((template_roi, roi, best_score))
+        return matches
 
     def match_protocol_rois(self, protocol_rois, plan_rois):
         template_rois, rois, scores = [], [], []
-        for plan_roi in plan_rois:
-            ans = self.get_best_template_roi_match(plan_roi)
+        for ans in self.get_best_template_roi_matches(plan_rois):
             template_rois.append(ans[0])
             rois.append(ans[1])
             scores.append(ans[2])
-            # print(plan_roi, ans)
 
         scores_by_template_roi = {}
         for i, template_roi in enumerate(template_rois):
@@ -106,6 +129,113 @@ class StructureAliases:
         return protocol_matches
 
 
+# All template ROIs and aliases with their cleaned names computed once, so matching a plan ROI only scores each
+# distinct cleaned name once.  Names are scored in order of an upper bound on their score from shared character
+# counts, and scoring stops once no remaining name can beat the best so far.  With rapidfuzz installed, fuzz.ratio
+# for every plan ROI and name comes from one batched matrix, so only partial_ratio is left.  Results are identical to
+# get_combined_fuzz_scores(roi, all_rois)[0], including its tie-break (the last of equally scored names wins)
+# and its scoring of the str() of clean_name's list.
+class AliasIndex:
+    def __init__(self, roi, simple=WEIGHT_SIMPLE, partial=WEIGHT_PARTIAL, match_cache=None):
+        self.w_simple = float(simple) if simple else 1.
+        self.w_partial = float(partial) if partial else 1.
+        self.match_cache = match_cache
+        # matches depend on the order of the alias table too, so hash it as listed
+        self.version = hashlib.sha1(repr((list(roi.items()), self.w_simple, self.w_partial)).encode()).hexdigest()
+
+        self.names = []
+        self.template_roi = {}  # {template roi or alias: template roi}, the first template listed wins
+        for template_roi in roi:
+            for name in [template_roi] + roi[template_roi]:
+                self.names.append(name)
+                self.template_roi.setdefault(name, template_roi)
+
+        # {cleaned name: index in names of the last name with that cleaned name}
+        self.exact = {}
+        for i, name in enumerate(self.names):
+            self.exact[str(clean_name(name))] = i
+        self.keys = list(self.exact)
+        self.name_index = np.array([self.exact[key] for key in self.keys], dtype=int)
+
+        self.characters = {c: i for i, c in enumerate(sorted(set(''.join(self.keys))))}
+        self.lengths = np.array([len(key) for key in self.keys], dtype=float)
+        self.counts = np.zeros((len(self.keys), len(self.characters)), dtype=float)
+        for i, key in enumerate(self.keys):
+            for c in key:
+                self.counts[i, self.characters[c]] += 1
+
+    def get_score(self, a, b):
+        simple = fuzz.ratio(a, b) * self.w_simple
+        partial = fuzz.partial_ratio(a, b) * self.w_partial
+        return float(simple) * float(partial) / 10000.
+
+    def get_bounds(self, key, simple=None):
+        # Levenshtein's ratio is at most 2 * common / (len_a + len_b), where common is the number of characters
+        # the two names share, and partial_ratio's best window is at most 2 * common / (shorter + common)
+        counts = np.zeros(len(self.characters))
+        for c in key:
+            if c in self.characters:
+                counts[self.characters[c]] += 1
+        common = np.minimum(self.counts, counts).sum(axis=1)
+        shorter = np.minimum(self.lengths, len(key))
+        if simple is None:
+            simple = np.ceil(200. * common / (self.lengths + len(key))) * self.w_simple
+        partial = np.minimum(100., np.ceil(200. * common / (shorter + common))) * self.w_partial
+        return simple * partial / 10000.
+
+    def get_ratio_matrix(self, keys):
+        # fuzz.ratio * w_simple of keys vs self.keys, fuzzywuzzy's ratio is int(round(100 * Levenshtein.ratio)) and
+        # Levenshtein.ratio is 1 - indel distance / (len_a + len_b).  It's calculated the same way here so halves
+        # round the same (np.round and round both round half to even, e.g., 1 - 46 / 80 is just over 0.425 but
+        # 34 / 80 is exactly 0.425).  rapidfuzz's partial_ratio can't be used the same way since it searches every
+        # window while fuzzywuzzy's only tries windows aligned to matching blocks
+        distances = process.cdist(keys, self.keys, scorer=distance.Indel.distance, workers=FUZZ_WORKERS)
+        lengths = self.lengths + np.array([len(key) for key in keys], dtype=float)[:, None]
+        return np.round(100. * (1. - distances / lengths)) * self.w_simple
+
+    def get_best_match(self, roi):
+        # returns (best matching template roi or alias, score)
+        return self.get_best_matches([roi])[0]
+
+    def get_best_matches(self, rois):
+        if not self.keys:
+            return [(None, 0.)] * len(rois)
+        keys = [str(clean_name(roi)) for roi in rois]
+        unique_keys = list(dict.fromkeys(keys))
+        matches = {} if self.match_cache is None else self.match_cache.get(unique_keys, self.version)
+
+        missing = [key for key in unique_keys if key not in matches]
+        if missing:
+            if process is None:
+                new_matches = {key: self.search(key, self.get_bounds(key)) for key in missing}
+            else:
+                simple = self.get_ratio_matrix(missing)
+                new_matches = {key: self.search(key, self.get_bounds(key, simple[i]), simple[i])
+                               for i, key in enumerate(missing)}
+            matches.update(new_matches)
+            if self.match_cache is not None:
+                self.match_cache.set(new_matches, self.version)
+
+        return [matches[key] for key in keys]
+
+    def search(self, key, bounds, simple=None):
+        best = (-1., -1)
+        if key in self.exact:
+            best = (self.get_score(key, key), self.exact[key])
+
+        for i in np.argsort(-bounds, kind='stable'):
+            if bounds[i] < best[0]:
+                break
+            if self.keys[i] != key:
+                if simple is None:
+                    score = self.get_score(key, self.keys[i])
+                else:
+                    score = float(simple[i]) * float(fuzz.partial_ratio(key, self.keys[i]) * self.w_partial) / 10000.
+                best = max(best, (score, int(self.name_index[i])))
+
+        return self.names[best[1]], best[0]
+
+
 def get_combined_fuzz_score(a, b, simple=None, partial=None):
     a = clean_name(a)
     b = clean_name(b)
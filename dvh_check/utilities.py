@@ -1,8 +1,15 @@
-from os.path import isdir, join, isfile, getmtime
-from os import walk, listdir
+from os.path import isdir, join, isfile
+from os import walk, listdir, stat
 import pydicom as dicom
 from pydicom.errors import InvalidDicomError
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from dicom_index import DicomIndex
+
+
+# Only these tags are parsed when scanning the inbox, see get_dicom_tag_values
+HEADER_TAGS = ['Modality', 'StudyInstanceUID', 'SOPInstanceUID', 'PatientName', 'RTPlanLabel', 'DoseSummationType',
+               'ReferencedStructureSetSequence', 'ReferencedRTPlanSequence']
 
 
 def get_file_paths(start_path, search_subfolders=True):
@@ -18,15 +25,32 @@ def get_file_paths(start_path, search_subfolders=True):
     return []
 
 
+def pool_map(func, *iterables, workers=1, use_processes=False):
+    # Like map(), but fanned out over a thread (or process) pool when workers > 1, results keep input order
+    if not workers or workers <= 1:
+        return list(map(func, *iterables))
+    if use_processes:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(func, *iterables, chunksize=16))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, *iterables))
+
+
 def timestamp_to_string(time_stamp):
     return datetime.fromtimestamp(time_stamp).strftime('%Y-%m-%d %H:%M:%S')
 
 
+FILE_TYPES = {'rtplan', 'rtstruct', 'rtdose'}
+
+
 class DicomDirectoryParser:
-    def __init__(self, start_path, search_subfolders=True):
+    def __init__(self, start_path, search_subfolders=True, index_file=None, workers=1, use_processes=False):
         self.start_path = start_path
         self.search_subfolders = search_subfolders
-        self.file_types = {'rtplan', 'rtstruct', 'rtdose'}
+        self.index_file = index_file
+        self.workers = workers
+        self.use_processes = use_processes
+        self.file_types = set(FILE_TYPES)
 
         self.__parse_directory_new()
         self.__validate()
@@ -34,70 +58,76 @@ class DicomDirectoryParser:
     def __parse_directory_new(self):
         self.file_paths = get_file_paths(self.start_path, search_subfolders=self.search_subfolders)
 
-        self.dicom_tag_values = {}
-        self.dicom_files = {key: [] for key in self.file_types}
-        self.plan_file_sets = {}
-
         # dicom_file_data:  collect necessary dicom tags with a dictionary with file_paths for keys
-        # dicom_files:      identify files by modality (key is modality)
-        # plan_file_sets:   this will be the useful object in the end, give it "Patient Name - Plan Name", get
-        #                   appropriate file paths.  GUI will use this.
+        self.dicom_tag_values = {file_path: tag_values for file_path, tag_values in self.__get_tag_values().items()
+                                 if tag_values is not None and tag_values['modality'] in self.file_types}
+        self.__link()
+
+    def __link(self):
+        self.dicom_files, self.plan_file_sets, self.dangling_references = link_plan_files(self.dicom_tag_values,
+                                                                                          self.file_types)
+
+    def __get_tag_values(self):
+        # Only open files that are new or changed since the last scan if an index file is provided
+        index = DicomIndex(self.index_file) if self.index_file else None
+        indexed = index.load() if index else {}
+
+        tag_values = {}
+        stale_files = []
+        self.file_stats = {}
         for file_path in self.file_paths:
-            ds = self.read_dicom_file(file_path)
-            if ds is not None:
-                modality = ds.Modality.lower()
-                timestamp = getmtime(file_path)
-
-                self.dicom_files[modality].append(file_path)
-
-                self.dicom_tag_values[file_path] = {'timestamp': timestamp,
-                                                    'study_instance_uid': ds.StudyInstanceUID,
-                                                    'sop_instance_uid': ds.SOPInstanceUID,
-                                                    'patient_name': str(ds.PatientName)}
-
-                if modality == 'rtplan':
-                    self.dicom_tag_values[file_path]['ref_sop_instance'] = {'type': 'struct',
-                                                                            'uid': ds.ReferencedStructureSetSequence[0].ReferencedSOPInstanceUID}
-                    plan_key = "%s - %s - %s" % (ds.PatientName, ds.RTPlanLabel, timestamp_to_string(timestamp))
-                    self.plan_file_sets[plan_key] = {'rtplan': {'file_path': file_path, 'sop_instance_uid': ds.SOPInstanceUID}}
-                elif modality == 'rtdose':
-                    self.dicom_tag_values[file_path]['ref_sop_instance'] = {'type': 'plan',
-                                                                            'uid': ds.ReferencedRTPlanSequence[0].ReferencedSOPInstanceUID}
-                else:
-                    self.dicom_tag_values[file_path]['ref_sop_instance'] = {'type': None, 'uid': None}
-
-        # associate appropriate rtdose files to plans
-        for dose_file in self.dicom_files['rtdose']:
-            dose_tag_values = self.dicom_tag_values[dose_file]
-            ref_plan_uid = dose_tag_values['ref_sop_instance']['uid']
-            for plan_file_set in self.plan_file_sets.values():
-                plan_uid = plan_file_set['rtplan']['sop_instance_uid']
-                if plan_uid == ref_plan_uid:
-                    plan_file_set['rtdose'] = {'file_path': dose_file,
-                                               'sop_instance_uid': dose_tag_values['sop_instance_uid']}
-        # associate appropriate rtstruct files to plans
-        for plan_file_set in self.plan_file_sets.values():
-            plan_file = plan_file_set['rtplan']['file_path']
-            ref_struct_uid = self.dicom_tag_values[plan_file]['ref_sop_instance']['uid']
-            for struct_file in self.dicom_files['rtstruct']:
-                struct_uid = self.dicom_tag_values[struct_file]['sop_instance_uid']
-                if struct_uid == ref_struct_uid:
-                    plan_file_set['rtstruct'] = {'file_path': struct_file,
-                                                 'sop_instance_uid': struct_uid}
+            file_stat = stat(file_path)
+            self.file_stats[file_path] = (file_stat.st_size, file_stat.st_mtime)
+            if file_path in indexed and indexed[file_path][:2] == (file_stat.st_size, file_stat.st_mtime):
+                tag_values[file_path] = indexed[file_path][2]
+            else:
+                tag_values[file_path] = None  # placeholder, keeps the serial file order
+                stale_files.append((file_path, file_stat))
+
+        # Header reads are mostly I/O bound, so these can be spread over a pool of workers
+        stale_values = pool_map(get_dicom_tag_values,
+                                [f[0] for f in stale_files], [f[1].st_mtime for f in stale_files],
+                                workers=self.workers, use_processes=self.use_processes)
+        for (file_path, file_stat), values in zip(stale_files, stale_values):
+            tag_values[file_path] = values
+            if index:
+                index.update(file_path, file_stat.st_size, file_stat.st_mtime, values)
+
+        if index:
+            index.remove([f for f in indexed if f not in tag_values and not isfile(f)])
+            index.commit()
+            index.close()
+
+        return tag_values
+
+    def update_files(self, tag_values, removed_files=None):
+        # Add or replace files using values from get_dicom_tag_values without rescanning, returns new plan names
+        old_plan_names = set(self.plan_file_sets)
+        for file_path, values in tag_values.items():
+            self.dicom_tag_values.pop(file_path, None)
+            if values is not None and values['modality'] in self.file_types:
+                self.dicom_tag_values[file_path] = values
+        for file_path in removed_files or []:
+            self.dicom_tag_values.pop(file_path, None)
+
+        self.__link()
+        self.__validate()
+        return [plan_name for plan_name in self.plan_names if plan_name not in old_plan_names]
 
     def __validate(self):
         bad_plans = []
         for key, plan_file_set in self.plan_file_sets.items():
-            if self.file_types != set(list(plan_file_set)):  # Does plan_file_set not have one of the file_types?
+            if not self.file_types.issubset(plan_file_set):  # Does plan_file_set not have one of the file_types?
                 bad_plans.append(key)
 
         for plan in bad_plans:
             self.plan_file_sets.pop(plan)
 
     @staticmethod
-    def read_dicom_file(file_path):
+    def read_dicom_file(file_path, specific_tags=None):
+        # specific_tags skips over elements that aren't needed (e.g., ROIContourSequence) without converting them
         try:
-            return dicom.read_file(file_path, stop_before_pixels=True)
+            return dicom.read_file(file_path, stop_before_pixels=True, specific_tags=specific_tags)
         except InvalidDicomError:
             return None
 
@@ -119,5 +149,101 @@ class DicomDirectoryParser:
         return {plan_name: self.get_plan_files(plan_name) for plan_name in self.plan_names}
 
 
-def get_plans(start_path):
-    return DicomDirectoryParser(start_path).plans
+def link_plan_files(dicom_tag_values, file_types=FILE_TYPES):
+    # dicom_files:          identify files by modality (key is modality)
+    # plan_file_sets:       this will be the useful object in the end, give it "Patient Name - Plan Name", get
+    #                       appropriate file paths.  GUI will use this.  Every rtdose referencing the plan is listed
+    #                       under 'rtdose_files', 'rtdose' is chosen from them by get_plan_dose, plans without one
+    #                       (e.g., only per-beam doses) are left incomplete
+    # dangling_references:  rtplan and rtdose files whose referenced SOP instance was not found
+    # UIDs are looked up in dictionaries, so linking is linear in the number of files
+    dicom_files = {key: [] for key in file_types}
+    plan_file_sets = {}
+    plan_keys_by_uid = {}
+    struct_files_by_uid = {}
+    for file_path, tag_values in dicom_tag_values.items():
+        modality = tag_values['modality']
+        dicom_files[modality].append(file_path)
+        if modality == 'rtplan':
+            plan_key = "%s - %s - %s" % (tag_values['patient_name'], tag_values['rt_plan_label'],
+                                         timestamp_to_string(tag_values['timestamp']))
+            plan_file_sets[plan_key] = {'rtplan': {'file_path': file_path,
+                                                   'sop_instance_uid': tag_values['sop_instance_uid']},
+                                        'rtdose_files': []}
+            plan_keys_by_uid[tag_values['sop_instance_uid']] = plan_key
+        elif modality == 'rtstruct':
+            struct_files_by_uid[tag_values['sop_instance_uid']] = file_path
+
+    dangling_references = {}
+
+    # associate appropriate rtdose files to plans
+    for dose_file in dicom_files['rtdose']:
+        dose_tag_values = dicom_tag_values[dose_file]
+        ref_plan_uid = dose_tag_values['ref_sop_instance']['uid']
+        if ref_plan_uid in plan_keys_by_uid:
+            dose = {'file_path': dose_file,
+                    'sop_instance_uid': dose_tag_values['sop_instance_uid'],
+                    'dose_summation_type': dose_tag_values['dose_summation_type']}
+            plan_file_sets[plan_keys_by_uid[ref_plan_uid]]['rtdose_files'].append(dose)
+        else:
+            dangling_references[dose_file] = dose_tag_values['ref_sop_instance']
+
+    for plan_file_set in plan_file_sets.values():
+        dose = get_plan_dose(plan_file_set['rtdose_files'])
+        if dose is not None:
+            plan_file_set['rtdose'] = dose
+
+    # associate appropriate rtstruct files to plans
+    for plan_file_set in plan_file_sets.values():
+        plan_file = plan_file_set['rtplan']['file_path']
+        ref_struct_uid = dicom_tag_values[plan_file]['ref_sop_instance']['uid']
+        if ref_struct_uid in struct_files_by_uid:
+            plan_file_set['rtstruct'] = {'file_path': struct_files_by_uid[ref_struct_uid],
+                                         'sop_instance_uid': ref_struct_uid}
+        else:
+            dangling_references[plan_file] = dicom_tag_values[plan_file]['ref_sop_instance']
+
+    return dicom_files, plan_file_sets, dangling_references
+
+
+def get_plan_dose(doses):
+    # The plan sum dose, or the only dose if it isn't a single beam's.  Beam doses would have to be summed, and with
+    # several fraction (or unlabelled) doses it isn't clear which is the plan's, so neither case returns a dose.
+    plan_doses = [dose for dose in doses if dose['dose_summation_type'] == 'PLAN']
+    if plan_doses:
+        return plan_doses[0]
+    if len(doses) == 1 and doses[0]['dose_summation_type'] != 'BEAM':
+        return doses[0]
+    return None
+
+
+def get_dicom_tag_values(file_path, timestamp=None):
+    ds = DicomDirectoryParser.read_dicom_file(file_path, specific_tags=HEADER_TAGS)
+    if ds is None:
+        return None
+
+    modality = ds.Modality.lower()
+    tag_values = {'modality': modality,
+                  'timestamp': timestamp if timestamp is not None else stat(file_path).st_mtime,
+                  'study_instance_uid': ds.StudyInstanceUID,
+                  'sop_instance_uid': ds.SOPInstanceUID,
+                  'patient_name': str(ds.PatientName),
+                  'rt_plan_label': None,
+                  'dose_summation_type': None}
+
+    if modality == 'rtplan':
+        tag_values['rt_plan_label'] = str(ds.RTPlanLabel)
+        tag_values['ref_sop_instance'] = {'type': 'struct',
+                                          'uid': ds.ReferencedStructureSetSequence[0].ReferencedSOPInstanceUID}
+    elif modality == 'rtdose':
+        tag_values['dose_summation_type'] = str(ds.get('DoseSummationType', '')).upper() or None
+        tag_values['ref_sop_instance'] = {'type': 'plan',
+                                          'uid': ds.ReferencedRTPlanSequence[0].ReferencedSOPInstanceUID}
+    else:
+        tag_values['ref_sop_instance'] = {'type': None, 'uid': None}
+
+    return tag_values
+
+
+def get_plans(start_path, index_file=None, workers=1):
+    return DicomDirectoryParser(start_path, index_file=index_file, workers=workers).plans
@@ -2,46 +2,77 @@ from bokeh.layouts import column, row
 from bokeh.models.widgets import Select, Button, DataTable, TableColumn, NumberFormatter, Div, HTMLTemplateFormatter
 from bokeh.models import ColumnDataSource, HoverTool, Spacer
 from bokeh.plotting import figure
-from dicompylercore import dicomparser, dvhcalc
-from protocols import Protocols, MAX_DOSE_VOLUME
-from utilities import get_plans
-from paths import INBOX_DIR
-from structure_aliases import StructureAliases
+from protocols import MAX_DOSE_VOLUME
+from services import get_services
+from dvh_engine import calculate_dvhs
+from scorecard import get_roi_keys, match_rois, calculate_constraint, get_pass_fail
+from plot_data import get_dvh_curves
+from patch_aggregator import PatchAggregator
+from metrics import METRICS_ENABLED, get_metrics, timed, count
 from bokeh.palettes import Colorblind8 as palette
 import itertools
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import traceback
+from time import perf_counter
 import numpy as np
 
+CALCULATION_THREADS = 4  # threads shared by all sessions for scorecard calculations
+
+CALCULATION_EXECUTOR = ThreadPoolExecutor(max_workers=CALCULATION_THREADS)
+PREFETCH_DVHS = False  # calculate every ROI's DVH for the plot in the background once a plan's scorecard starts
+
 
 class ScoreCardView:
-    def __init__(self):
+    def __init__(self, doc=None, services=None):
 
         # Initialize Data Objects
         self.dvh = None
-        self.dvh_counts = []
-        self.dvh_counts_for_plot = None
-        self.bin_count = 0
-        self.bin_counts = None
+        self.dvh_uids = None
+        self.plot_pending = set()  # roi keys with a DVH being calculated for the plot
         self.roi_keys = None
         self.roi_names = None
         self.roi_key_map = None
         self.plans = None
+        self.plan_file_sets = None
+        self.doc = doc
+        self.calculation_id = 0
+        self.rows_calculated = 0
+        self.scorecard_running = False
+        self.inbox_scanning = False
+        self.keys_calculating = set()  # roi keys with a DVH being calculated for the table
         self.structures = None
         self.protocol_data = None
         self.roi_override = {}
-        self.aliases = StructureAliases()
-        self.protocols = Protocols()
+
+        # Shared by every session in this process, see services.py
+        self.services = get_services() if services is None else services
+        self.dicom_cache = self.services.dicom_cache
+        self.dvh_cache = self.services.dvh_cache
+        self.aliases = self.services.aliases
+        self.protocols = self.services.protocols
+
         self.source_data = ColumnDataSource(data=dict(roi_name=[], roi_template=[], roi_key=[], volume=[], min_dose=[],
                                                       mean_dose=[], max_dose=[], constraint=[], constraint_calc=[],
                                                       pass_fail=[], calc_type=[]))
         self.source_plot = ColumnDataSource(data=dict(x=[], y=[], color=[], roi=[], roi_key=[]))
+        # row updates are sent as one patch per tick, read patched cells with get, see patch_aggregator.py
+        self.table_patches = PatchAggregator(self.source_data, doc)
+        self.plot_patches = PatchAggregator(self.source_plot, doc)
         self.colors = itertools.cycle(palette)
 
         self.__define_layout_objects()
         self.__do_bind()
         self.__do_layout()
 
+        if doc is not None:
+            doc.on_session_destroyed(self.session_destroyed_listener)
+            self.services.add_listener(self.inbox_listener)
+
         self.update_protocol_data()
         self.initialize_source_data()
+        if doc is not None and self.services.scanned:  # e.g., scanned by on_server_loaded or another session
+            self.update_plans()
 
     def __define_layout_objects(self):
         # Report heading data
@@ -51,10 +82,14 @@ class ScoreCardView:
         self.select_fx = Select(title='Fractions:', value='3', options=self.fractionation_options, width=60)
         self.button_calculate = Button(label='Calculate Scorecard', button_type='primary')
         self.button_delete_roi = Button(label='Delete Constraint', button_type='warning')
+        self.button_export = Button(label='Export Results', button_type='primary')
         self.button_calculate_dvhs = Button(label='Calculate DVHs', button_type='primary', width=200)
         self.select_roi_template = Select(title='Template ROI:')
         self.select_roi = Select(title='Plan ROI:')
         self.max_dose_volume = Div(text="<b>Point defined as %scc" % MAX_DOSE_VOLUME)
+        self.diagnostics = Div(width=800)
+        self.button_diagnostics = Button(label='Refresh Diagnostics', button_type='default', width=200)
+        self.button_reset_diagnostics = Button(label='Reset Diagnostics', button_type='warning', width=200)
 
         self.columns = [TableColumn(field="roi_template", title="Template ROI"),
                         TableColumn(field="roi_name", title="ROI"),
@@ -97,6 +132,7 @@ class ScoreCardView:
     def __do_bind(self):
         self.button_calculate.on_click(self.initialize_source_data)
         self.button_delete_roi.on_click(self.delete_selected_rows)
+        self.button_export.on_click(self.export_results)
         self.select_protocol.on_change('value', self.protocol_listener)
         self.select_fx.on_change('value', self.fx_listener)
         self.button_refresh_plans.on_click(self.update_plan_options)
@@ -104,18 +140,24 @@ class ScoreCardView:
         self.select_roi_template.on_change('value', self.template_roi_listener)
         self.select_roi.on_change('value', self.roi_listener)
         self.source_data.selected.on_change('indices', self.source_select)
-        self.button_calculate_dvhs.on_click(self.update_dvh_plot)
+        self.source_plot.selected.on_change('indices', self.plot_select)
+        self.button_calculate_dvhs.on_click(self.prefetch_dvhs)
+        self.button_diagnostics.on_click(self.update_diagnostics)
+        self.button_reset_diagnostics.on_click(self.reset_diagnostics)
 
     def __do_layout(self):
 
         self.layout = column(self.button_refresh_plans,
                              row(self.select_plan, self.select_protocol, self.select_fx),
-                             row(self.button_calculate, self.button_delete_roi),
+                             row(self.button_calculate, self.button_delete_roi, self.button_export),
                              row(self.select_roi_template, self.select_roi),
                              self.max_dose_volume,
                              self.data_table,
                              row(self.plot, Spacer(width=10), column(self.button_calculate_dvhs,
                                                                      self.plot_rois)))
+        if METRICS_ENABLED:  # see metrics.py
+            self.layout.children.append(column(row(self.button_diagnostics, self.button_reset_diagnostics),
+                                               self.diagnostics))
 
     @property
     def __pass_fail_formatter(self):
@@ -187,22 +229,17 @@ class ScoreCardView:
     def roi_listener(self, attr, old, new):
         template_rois = self.source_data.data['roi_template']
         indices = [i for i, roi in enumerate(template_rois) if roi == self.select_roi_template.value]
+        if indices and all(self.table_patches.get('roi_name', i) == new for i in indices):
+            return  # e.g., update_roi_select showing the current match
         if indices:
             patches = {'roi_name': [(i, new) for i in indices]}
-            self.source_data.patch(patches)
+            self.table_patches.patch(patches)
         if new:
             self.roi_override[self.select_roi_template.value] = new
             self.button_calculate.button_type = 'success'
-            total = len(indices)
-            for i in indices:
-                self.button_calculate.label = 'Calculating ScoreCard %s of %s' % (i+1, total)
-                key = self.roi_key_map[new]
-                self.calculate_dvh(key)
-                self.update_table_row(i, key)
-                self.source_data.patch({'roi_key': [(i, key)]})
-                self.update_constraint(i)
-            self.button_calculate.label = 'Calculate Scorecard'
-            self.button_calculate.button_type = 'primary'
+            key = self.roi_key_map[new]
+            self.table_patches.patch({'roi_key': [(i, key) for i in indices]})
+            self.calculate_key_rows(key)
         else:
             if self.button_calculate.button_type == 'primary' and self.select_roi_template.value in self.roi_override:
                 self.roi_override.pop(self.select_roi_template.value)
@@ -213,46 +250,123 @@ class ScoreCardView:
                        'constraint_calc': [(i, 0.) for i in indices],
                        'pass_fail': [(i, '') for i in indices],
                        'roi_key': [(i, '') for i in indices]}
-            self.source_data.patch(patches)
+            self.table_patches.patch(patches)
 
     def source_select(self, attr, old, new):
         if new:
             self.select_roi_template.value = self.source_data.data['roi_template'][new[0]]
 
+    def plot_select(self, attr, old, new):
+        # DVHs are only calculated once their ROI is selected for plotting, or by prefetch_dvhs
+        self.calculate_plot_rows([i for i in new if not len(self.plot_patches.get('y', i))])
+
+    def session_destroyed_listener(self, session_context):
+        self.calculation_id += 1  # let any background calculation stop early
+        self.services.remove_listener(self.inbox_listener)
+
     # Methods -------------------------------------------------------------------
     def update_protocol_data(self):
         self.protocol_data = self.protocols.get_column_data(self.protocol, self.fractionation)
 
     def initialize_source_data(self):
+        self.calculation_id += 1  # results of calculations started before this point are discarded
         data = self.protocol_data
-        self.bin_counts = None
-        self.bin_count = None
-        self.dvh = {}
-        self.dvh_counts_for_plot = []
-        self.dvh_counts = []
+        plan = self.select_plan.value
+        uids = self.get_uids(plan) if self.plan_file_sets and plan in self.plan_file_sets else None
+        if self.dvh_uids != uids:  # DVHs are shared with every session viewing the same plan
+            self.dvh = self.services.get_plan_dvhs(*uids) if uids else {}
+            self.dvh_uids = uids
         row_count = len(data['roi_template'])
-        new_data = {'roi_template': data['roi_template'],
+        new_data = {'roi_template': list(data['roi_template']),
                     'roi_key': [''] * row_count,
                     'roi_name': [''] * row_count,
                     'volume': [''] * row_count,
                     'min_dose': [''] * row_count,
                     'mean_dose': [''] * row_count,
                     'max_dose': [''] * row_count,
-                    'constraint': data['string_rep'],
+                    'constraint': list(data['string_rep']),
                     'constraint_calc': [''] * row_count,
                     'pass_fail': [''] * row_count,
-                    'calc_type': data['calc_type']}
+                    'calc_type': list(data['calc_type'])}
 
+        self.plot_pending = set()
+        self.source_plot.selected.indices = []
+        self.plot_patches.clear()
         self.source_plot.data = {'x': [], 'y': [], 'color': [], 'roi': [], 'roi_key': []}
+        self.update_calculate_dvhs_button()
 
+        self.table_patches.clear()
         self.source_data.data = new_data
+        self.button_export.label = 'Export Results'
         self.update_roi_template_select()
+        self.keys_calculating = set()
+        self.scorecard_running = False
         if self.select_plan.value:
-            self.button_calculate.label = 'Calculating Scorecard...'
-            self.button_calculate.button_type = 'success'
-            self.update_plan_structures()
+            self.start_scorecard()
+
+    def start_scorecard(self):
+        self.button_calculate.label = 'Calculating Scorecard...'
+        self.button_calculate.button_type = 'success'
+        self.rows_calculated = 0
+        self.scorecard_running = True
+        self.run_in_background(self.calculate_scorecard, self.select_plan.value, self.dvh,
+                               list(self.source_data.data['roi_template']), dict(self.roi_override))
+
+    def run_in_background(self, func, *args):
+        # func(calculation_id, *args) runs in a worker thread so the server stays responsive for every session,
+        # without a document (e.g., headless use) it runs immediately
+        if self.doc is None:
+            func(self.calculation_id, *args)
+        else:
+            CALCULATION_EXECUTOR.submit(self.__run, func, self.calculation_id, *args)
+
+    def __run(self, func, calculation_id, *args):
+        try:
+            func(calculation_id, *args)
+        except Exception:
+            traceback.print_exc()
+            self.next_tick(calculation_id, self.reset_calculate_button)
+
+    def next_tick(self, calculation_id, func, *args):
+        # Bokeh models may only be changed on the document's thread, updates from stale calculations are dropped
+        if self.doc is None:
+            self.__apply(calculation_id, func, *args)
+        else:
+            self.doc.add_next_tick_callback(partial(self.__apply, calculation_id, func, *args))
+
+    def __apply(self, calculation_id, func, *args):
+        if calculation_id == self.calculation_id:
+            func(*args)
+
+    def reset_calculate_button(self):
+        self.scorecard_running = False
+        self.button_calculate.label = 'Calculate Scorecard'
+        self.button_calculate.button_type = 'primary'
+        if METRICS_ENABLED:
+            self.update_diagnostics()
+
+    def update_diagnostics(self):
+        # stage timings and cache counters of this server process, shared by every session
+        snapshot = get_metrics().get_snapshot()
+        lines = ['<table><tr><th align="left">Stage</th><th>Calls</th><th>Total (ms)</th><th>Mean (ms)</th>'
+                 '<th>Max (ms)</th></tr>']
+        for stage, stats in sorted(snapshot['stages'].items()):
+            lines.append('<tr><td>%s</td><td align="right">%d</td><td align="right">%.1f</td>'
+                         '<td align="right">%.1f</td><td align="right">%.1f</td></tr>' %
+                         (stage, stats['calls'], 1e3 * stats['total'], 1e3 * stats['mean'], 1e3 * stats['max']))
+        lines.append('</table><table><tr><th align="left">Counter</th><th>Count</th></tr>')
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append('<tr><td>%s</td><td align="right">%d</td></tr>' % (name, value))
+        lines.append('</table>')
+        self.diagnostics.text = ''.join(lines)
+        get_metrics().log()
+
+    def reset_diagnostics(self):
+        get_metrics().reset()
+        self.update_diagnostics()
 
     def delete_selected_rows(self):
+        self.table_patches.flush()
         selected_indices = self.source_data.selected.indices
         selected_indices.sort(reverse=True)
         if not selected_indices:
@@ -261,10 +375,33 @@ class ScoreCardView:
         for index in selected_indices:
             for key in list(data):
                 data[key].pop(index)
+            for key in list(self.protocol_data):
+                self.protocol_data[key].pop(index)
 
         self.source_data.data = data
         self.source_data.selected.indices = []
 
+        if self.scorecard_running:
+            # results still queued for the old rows refer to them by position, so calculate the remaining rows again
+            self.calculation_id += 1
+            self.keys_calculating = set()
+            self.start_scorecard()
+
+    def export_results(self):
+        # appends the table as shown, with every DVH calculated so far for the plan, see export.py
+        plan = self.select_plan.value
+        if not plan or plan not in self.plan_file_sets:
+            return
+        self.table_patches.flush()
+        plan_uid = self.plan_file_sets[plan]['rtplan']['sop_instance_uid']
+        data = self.source_data.data
+        rows = [dict({column: data[column][i] for column in data}, plan=plan, plan_uid=plan_uid,
+                     protocol=self.protocol, fractionation=self.select_fx.value)
+                for i in range(len(data['roi_template']))]
+        dvhs = [(plan_uid, key, self.dvh[key]) for key in list(self.dvh)]
+        part = self.services.results_export.append(rows, dvhs)
+        self.button_export.label = 'Exported %s rows, %s DVHs' % (part['rows'], part['dvhs'])
+
     def update_roi_template_select(self):
         options = list(set(self.source_data.data['roi_template']))
         options.sort()
@@ -273,154 +410,222 @@ class ScoreCardView:
             self.select_roi_template.value = options[0]
 
     def update_plan_options(self):
+        # rescans the shared inbox in a worker thread, every session's plan options are updated through inbox_listener
+        if self.inbox_scanning:
+            return
+        self.inbox_scanning = True
         self.button_refresh_plans.button_type = 'success'
         self.button_refresh_plans.label = 'Updating...'
-        self.plans = get_plans(INBOX_DIR)
-        self.select_plan.options = list(self.plans)
+        self.run_in_background(self.scan_inbox)
+
+    @timed('scan_inbox')
+    def scan_inbox(self, calculation_id):
+        # runs in a worker thread, see run_in_background.  A scan isn't made stale by a new calculation, so the button
+        # is reset with a plain next tick callback instead of next_tick
+        try:
+            self.services.scan_inbox()
+        except Exception:
+            traceback.print_exc()
+        if self.doc is None:
+            self.reset_refresh_plans_button()
+        else:
+            self.doc.add_next_tick_callback(self.reset_refresh_plans_button)
+
+    def reset_refresh_plans_button(self):
+        self.inbox_scanning = False
         self.button_refresh_plans.button_type = 'primary'
         self.button_refresh_plans.label = 'Scan DICOM Inbox'
-        if self.select_plan.value not in list(self.plans):
+        self.update_plans()
+
+    def update_plans(self):
+        self.plans, self.plan_file_sets = self.services.get_plans()
+        self.select_plan.options = list(self.plans)
+        if self.select_plan.value not in list(self.plans) and self.plans:
             self.select_plan.value = list(self.plans)[0]
 
-    def update_plan_structures(self):
-        self.structures = dicomparser.DicomParser(self.current_struct_file).GetStructures()
-        self.roi_keys = [key for key in self.structures if self.structures[key]['type'].upper() != 'MARKER']
+    def inbox_listener(self):
+        # called from the watcher thread, or the thread of the session that rescanned the inbox
+        self.doc.add_next_tick_callback(self.update_inbox_plans)
+
+    def update_inbox_plans(self):
+        self.plans, self.plan_file_sets = self.services.get_plans()
+        self.select_plan.options = list(self.plans)
+
+    @timed('calculate_scorecard')
+    def calculate_scorecard(self, calculation_id, plan, dvh, roi_templates, roi_override):
+        # runs in a worker thread, see run_in_background
+        structures = self.dicom_cache.get_parser(self.plans[plan]['rtstruct']).GetStructures()
+        matched_rows = match_rois(self.aliases, roi_templates, structures, roi_override=roi_override)
+        self.next_tick(calculation_id, self.update_plan_structures, structures, matched_rows)
+
+        keys = list({key: None for match, key in matched_rows if key})
+        total = len([key for match, key in matched_rows if key])
+        self.calculate_rows(calculation_id, plan, dvh, keys, total=total)
+
+    @timed('update_plan_structures')
+    def update_plan_structures(self, structures, matched_rows):
+        self.keys_calculating.update(key for match, key in matched_rows if key)
+        self.structures = structures
+        self.roi_keys = get_roi_keys(self.structures)
         self.roi_names = [str(self.structures[key]['name']) for key in self.roi_keys]
         self.roi_key_map = {name: self.roi_keys[i] for i, name in enumerate(self.roi_names)}
         self.select_roi.options = [''] + self.roi_names
         self.update_roi_select()
-        self.match_rois()
+        self.match_rois(matched_rows)
+        self.initialize_plot_data()
 
     def update_roi_select(self):
         index = self.source_data.data['roi_template'].index(self.select_roi_template.value)
-        self.select_roi.value = self.source_data.data['roi_name'][index]
+        self.select_roi.value = self.table_patches.get('roi_name', index)
 
-    def match_rois(self):
-        matches = self.aliases.match_protocol_rois(self.source_data.data['roi_template'], self.roi_names)
+    def match_rois(self, matched_rows):
         patches = {'roi_name': [], 'roi_key': []}
-        for i, protocol_roi in enumerate(self.source_data.data['roi_template']):
-            if protocol_roi in list(matches):
-                match = matches[protocol_roi]
-            else:
-                match = ''
-            if protocol_roi in list(self.roi_override):
-                match = self.roi_override[protocol_roi]
-            if match:
-                key = self.roi_key_map[match]
-            else:
-                key = ''
+        for i, (match, key) in enumerate(matched_rows):
             patches['roi_name'].append((i, match))
             patches['roi_key'].append((i, key))
-        self.source_data.patch(patches)
+        self.table_patches.patch(patches)
         self.update_roi_select()
-        self.calculate_protocol_dvhs()
+
+    def calculate_rows(self, calculation_id, plan, dvh, keys, total=None):
+        # runs in a worker thread, the rows showing each key are patched as its DVH finishes.  With a total (the
+        # scorecard's row count), the calculate button shows the progress and is reset at the end.
+        for key in self.iter_dvhs(keys, plan=plan, dvh=dvh):
+            if calculation_id != self.calculation_id:
+                return
+            self.next_tick(calculation_id, self.update_rows, key, total)
+        if total is not None:
+            self.next_tick(calculation_id, self.reset_calculate_button)
+
+    def calculate_key_rows(self, key):
+        # rows switched to key by roi_listener, a key the scorecard is already calculating isn't calculated again
+        if key in self.dvh:
+            self.update_rows(key)
+        elif key not in self.keys_calculating:
+            self.keys_calculating.add(key)
+            self.run_in_background(self.calculate_rows, self.select_plan.value, self.dvh, [key])
+
+    def update_rows(self, key, total=None):
+        # rows are found by their current roi key rather than by position
+        self.keys_calculating.discard(key)
+        indices = [i for i in range(len(self.source_data.data['roi_key']))
+                   if self.table_patches.get('roi_key', i) == key]
+        for i in indices:
+            self.update_table_row(i, key)
+            self.update_constraint(i)
+        if total is not None:
+            self.rows_calculated += len(indices)
+            self.button_calculate.label = 'Calculating Scorecard %s of %s' % (self.rows_calculated, total)
+        elif not self.scorecard_running:
+            self.reset_calculate_button()
 
     def update_table_row(self, index, key):
         patch = {'volume': [(index, self.dvh[key].volume)],
                  'min_dose': [(index, self.dvh[key].min)],
                  'mean_dose': [(index, self.dvh[key].mean)],
                  'max_dose': [(index, self.dvh[key].max)]}
-        self.source_data.patch(patch)
-
-    def calculate_dvh(self, key):
-        if key not in list(self.dvh):
-            files = self.plans[self.select_plan.value]
-            self.dvh[key] = dvhcalc.get_dvh(files['rtstruct'], files['rtdose'], key)
-
-    def calculate_dvhs(self):
-        current_button_type = self.button_calculate.button_type
-        current_button_label = self.button_calculate.label
-        self.button_calculate_dvhs.button_type = 'success'
-
-        files = self.plans[self.select_plan.value]
-        total = len(self.roi_keys)
-        for i, key in enumerate(list(self.roi_keys)):
-            self.button_calculate_dvhs.label = 'Calculating DVH: %s of %s' % (i+1, total)
-            if key not in list(self.dvh):
-                self.dvh[key] = dvhcalc.get_dvh(files['rtstruct'], files['rtdose'], key)
-        self.dvh_counts = [self.dvh[key].counts for key in self.roi_keys]
-        self.button_calculate.button_type = current_button_type
-        self.button_calculate.label = current_button_label
-
-    def calculate_protocol_dvhs(self):
-        self.dvh = {}
-        total = len([key for key in self.source_data.data['roi_key'] if key != ''])
-        counter = 1
-        for i, key in enumerate(self.source_data.data['roi_key']):
-            if key:
-                self.button_calculate.label = 'Calculating Scorecard %s of %s' % (counter, total)
-                self.calculate_dvh(key)
-                self.update_table_row(i, key)
-                self.update_constraint(i)
-                counter += 1
-
-        self.button_calculate.label = 'Calculate Scorecard'
-        self.button_calculate.button_type = 'primary'
-
+        self.table_patches.patch(patch)
+
+    def get_uids(self, plan):
+        plan_file_set = self.plan_file_sets[plan]
+        return plan_file_set['rtstruct']['sop_instance_uid'], plan_file_set['rtdose']['sop_instance_uid']
+
+    def iter_dvhs(self, keys, plan=None, dvh=None):
+        # Yields each key once dvh[key] is available, DVHs not already cached are calculated in parallel
+        plan = self.select_plan.value if plan is None else plan
+        dvh = self.dvh if dvh is None else dvh
+        uids = self.get_uids(plan)
+        uncached_keys = []
+        for key in keys:
+            if key in dvh:
+                count('plan_dvhs.hit')
+            else:
+                cached_dvh = self.dvh_cache.get(uids[0], uids[1], key)
+                if cached_dvh is None:
+                    uncached_keys.append(key)
+                    continue
+                dvh[key] = cached_dvh
+            yield key
+
+        if not uncached_keys:
+            return
+        files = self.plans[plan]
+        start = perf_counter()
+        for key, calculated_dvh in calculate_dvhs(files['rtstruct'], files['rtdose'], uncached_keys,
+                                                  dicom_cache=self.dicom_cache):
+            dvh[key] = calculated_dvh
+            self.dvh_cache.set(uids[0], uids[1], key, calculated_dvh)
+            yield key
+        if METRICS_ENABLED:  # the DVHs may be calculated in worker processes
+            get_metrics().record('calculate_dvhs', perf_counter() - start)
+            count('dvhs.calculated', len(uncached_keys))
+
+    @timed('update_constraint')
     def update_constraint(self, index):
 
-        if self.source_data.data['roi_name'][index]:
+        if self.table_patches.get('roi_name', index):
             constraint = self.calculate_constraint(index)
+            status = get_pass_fail(constraint, self.protocol_data['operator'][index],
+                                   self.protocol_data['threshold_value'][index])
 
-            operator = self.protocol_data['operator'][index]
-            threshold = self.protocol_data['threshold_value'][index]
-
-            if constraint is not None:
-                if operator == '<':
-                    status = constraint < threshold
-                else:
-                    status = constraint > threshold
-                status = ['Fail', 'Pass'][status]
-            else:
-                status = ''
-
-            self.source_data.patch({'constraint_calc': [(index, constraint)],
-                                    'pass_fail': [(index, status)]})
+            self.table_patches.patch({'constraint_calc': [(index, constraint)],
+                                      'pass_fail': [(index, status)]})
 
     def calculate_constraint(self, index):
-        dvh = self.dvh[self.source_data.data['roi_key'][index]]
-        calc_type = self.source_data.data['calc_type'][index]
-        input_value = self.protocol_data['input_value'][index]
-        if calc_type == 'Volume':
-            ans = dvh.dose_constraint(input_value, volume_units='cm3')
-            return float(str(ans).split(' ')[0])
-        if calc_type == 'Dose':
-            ans = dvh.volume_constraint(input_value, dose_units='Gy')
-            return float(str(ans).split(' ')[0])
-        if calc_type == 'Mean':
-            return self.source_data.data['mean_dose'][index]
-        if calc_type == 'MVS':
-            ans = dvh.volume_constraint(input_value, dose_units='Gy')
-            ans = float(str(ans).split(' ')[0])
-            return self.source_data.data['volume'][index] - ans
-
-        return None
+        return calculate_constraint(self.dvh[self.table_patches.get('roi_key', index)],
+                                    self.source_data.data['calc_type'][index], self.protocol_data['input_value'][index])
 
     @property
     def volumes(self):
         return np.array([self.dvh[key].volume for key in self.roi_keys])
 
-    def pad_dvh_counts(self):
-        self.bin_count = max([len(dvh) for dvh in self.dvh_counts])
-        self.dvh_counts_for_plot = []
-        self.bin_counts = []
-        for dvh in self.dvh_counts:
-            if dvh[0]:
-                self.dvh_counts_for_plot.append(np.divide(dvh, dvh[0]))
-            else:
-                self.dvh_counts_for_plot.append(np.array([0] * self.bin_count))
-            np.append(self.dvh_counts_for_plot[-1], [0])  # ensure last value is 0
-            x_axis = np.divide(np.array(list(range(len(self.dvh_counts_for_plot[-1])))), 100.)
-            self.bin_counts.append(x_axis)
-
-    def update_dvh_plot(self):
-        self.calculate_dvhs()
-        self.pad_dvh_counts()
-        colors = [color for j, color in zip(range(len(self.dvh_counts_for_plot)), self.colors)]
-        self.source_plot.data = {'x': self.bin_counts,
-                                 'y': self.dvh_counts_for_plot,
-                                 'color': colors,
+    def initialize_plot_data(self):
+        # every plan ROI is listed for plotting, curves are filled in by update_plot_row
+        self.plot_pending = set()
+        self.source_plot.selected.indices = []
+        self.plot_patches.clear()
+        self.source_plot.data = {'x': [np.zeros(0, dtype=np.float32) for _ in self.roi_keys],
+                                 'y': [np.zeros(0, dtype=np.float32) for _ in self.roi_keys],
+                                 'color': [color for j, color in zip(range(len(self.roi_keys)), self.colors)],
                                  'roi': self.roi_names,
                                  'roi_key': self.roi_keys}
-        self.button_calculate_dvhs.label = 'Calculate DVHs'
-        self.button_calculate_dvhs.button_type = 'primary'
+        self.update_calculate_dvhs_button()
+        if PREFETCH_DVHS:
+            self.prefetch_dvhs()
+
+    def prefetch_dvhs(self):
+        self.calculate_plot_rows([i for i in range(len(self.source_plot.data['y']))
+                                  if not len(self.plot_patches.get('y', i))])
+
+    def calculate_plot_rows(self, indices):
+        # DVHs already calculated for the scorecard are reused, see iter_dvhs
+        keys = [self.source_plot.data['roi_key'][i] for i in indices]
+        keys = [key for key in keys if key not in self.plot_pending]
+        if keys and self.select_plan.value:
+            self.plot_pending.update(keys)
+            self.update_calculate_dvhs_button()
+            self.run_in_background(self.calculate_plot_dvhs, self.select_plan.value, self.dvh, keys)
+
+    def calculate_plot_dvhs(self, calculation_id, plan, dvh, keys):
+        # runs in a worker thread, see run_in_background
+        for key in self.iter_dvhs(keys, plan=plan, dvh=dvh):
+            if calculation_id != self.calculation_id:
+                return
+            self.next_tick(calculation_id, self.update_plot_row, key)
+
+    @timed('update_plot_row')
+    def update_plot_row(self, key):
+        self.plot_pending.discard(key)
+        if key not in self.source_plot.data['roi_key']:
+            return
+        index = self.source_plot.data['roi_key'].index(key)
+        xs, ys = get_dvh_curves([self.dvh[key].counts])
+        self.plot_patches.patch({'x': [(index, xs[0])], 'y': [(index, ys[0])]})
+        self.update_calculate_dvhs_button()
+
+    def update_calculate_dvhs_button(self):
+        if self.plot_pending:
+            self.button_calculate_dvhs.label = 'Calculating DVHs: %s remaining' % len(self.plot_pending)
+            self.button_calculate_dvhs.button_type = 'success'
+        else:
+            self.button_calculate_dvhs.label = 'Calculate DVHs'
+            self.button_calculate_dvhs.button_type = 'primary'
@@ -1,7 +1,7 @@
 from setuptools import setup, find_packages
 
 requires = [
-    'dicompyler-core',
+    'dicompyler-core>=0.5.6,<0.6',  # dvh_stream uses DicomParser internals, it falls back to dvhcalc if they change
     'fuzzywuzzy',
     'python-levenshtein',
     'bokeh',
@@ -23,6 +23,7 @@ setup(
     keywords=['dvh', 'radiation therapy', 'dicom', 'dicom-rt', 'bokeh'],
     classifiers=[],
     install_requires=requires,
+    extras_require={'fast': ['rapidfuzz']},
     entry_points={
         'console_scripts': [
             'dvh_check=dvh_check.__main__:main',